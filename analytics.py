@@ -0,0 +1,290 @@
+"""
+Analítica de engagement por campaña en el tiempo.
+
+Los envíos, aperturas y clics se acumulan en memoria y un hilo los vuelca cada
+ANALYTICS_FLUSH_SECONDS a `engagement_rollups` con un upsert que suma sobre la fila del
+minuto y de la hora correspondientes. Las curvas y comparaciones se leen solo de esas
+filas: su coste depende del rango de tiempo pedido, no del número de destinatarios.
+
+Cada worker tiene su propio acumulador; como el upsert suma, los volcados de varios
+procesos se combinan sin conflicto. Si un proceso muere sin salir limpiamente se
+pierden como mucho los últimos segundos de contadores.
+"""
+
+from models import db, Campaign, EngagementRollup
+from config import Config
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import sqlite, postgresql
+import atexit
+import os
+import threading
+import time
+
+
+GRANULARITIES = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1)}
+COUNTERS = ('sends', 'opens', 'unique_opens', 'clicks', 'unique_clicks', 'machine_opens', 'machine_clicks')
+MAX_POINTS = 2000             # Puntos máximos por curva
+PRUNE_EVERY_SECONDS = 3600    # Limpieza de los rollups por minuto antiguos
+MAX_FLUSH_ATTEMPTS = 10       # Volcados fallidos de una fila antes de descartar sus contadores
+
+
+def bucket_start(at, granularity):
+    """Inicio del minuto u hora que contiene `at`"""
+    if granularity == 'hour':
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(second=0, microsecond=0)
+
+
+def upsert_rollups(pending):
+    """Suma los contadores {(campaign_id, granularity, bucket): Counter} a sus filas"""
+    rows = [
+        {
+            'campaign_id': campaign_id,
+            'granularity': granularity,
+            'bucket': bucket,
+            **{counter: counts.get(counter, 0) for counter in COUNTERS}
+        }
+        for (campaign_id, granularity, bucket), counts in pending.items()
+    ]
+    table = EngagementRollup.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['campaign_id', 'granularity', 'bucket'],
+            set_={counter: table.c[counter] + stmt.excluded[counter] for counter in COUNTERS}
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # Otros motores: UPDATE y, si la fila no existe, INSERT
+    for row in rows:
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.campaign_id == row['campaign_id'],
+                   table.c.granularity == row['granularity'],
+                   table.c.bucket == row['bucket'])
+            .values({counter: table.c[counter] + row[counter] for counter in COUNTERS})
+        ).rowcount
+        if not updated:
+            db.session.execute(table.insert().values(row))
+
+
+class RollupAccumulator:
+    """Contadores pendientes de volcar a engagement_rollups"""
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+        self._failures = Counter()    # Volcados fallidos por fila pendiente
+        self._thread = None
+        self._pid = os.getpid()
+        self._pruned_at = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.flush)
+
+    def record(self, campaign_id, event, unique=False, at=None):
+        """Suma un evento ('sends', 'opens', 'clicks'...) en el minuto y la hora de `at`"""
+        at = at or datetime.utcnow()
+        with self._lock:
+            for granularity in GRANULARITIES:
+                counts = self._pending[(campaign_id, granularity, bucket_start(at, granularity))]
+                counts[event] += 1
+                if unique:
+                    counts[f'unique_{event}'] += 1
+        self._start()
+
+    def discard(self, campaign_id):
+        """Olvida los contadores pendientes de una campaña (al eliminarla)"""
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == campaign_id]:
+                del self._pending[key]
+                self._failures.pop(key, None)
+
+    def flush(self):
+        """
+        Vuelca los contadores pendientes. Si el lote falla se reintenta fila a fila: las que
+        vuelven a fallar se conservan para el siguiente volcado hasta MAX_FLUSH_ATTEMPTS, así
+        que una fila con un error permanente no bloquea las demás.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+        if not pending or self.app is None:
+            return
+
+        with self.app.app_context():
+            try:
+                # Las campañas eliminadas (tokens aún en cache en otros workers) se descartan
+                campaign_ids = {campaign_id for campaign_id, _, _ in pending}
+                existing = {
+                    row.id for row in db.session.query(Campaign.id).filter(Campaign.id.in_(campaign_ids))
+                }
+                pending = {key: counts for key, counts in pending.items() if key[0] in existing}
+                if pending:
+                    upsert_rollups(pending)
+                    db.session.commit()
+                failed = {}
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error al volcar analítica: {e}")
+                failed = self._flush_each(pending)
+            finally:
+                db.session.remove()
+
+        with self._lock:
+            for key in pending:
+                if key not in failed:
+                    self._failures.pop(key, None)
+            for key, counts in failed.items():
+                self._failures[key] += 1
+                if self._failures[key] >= MAX_FLUSH_ATTEMPTS:
+                    self._failures.pop(key)
+                    print(f"Analítica descartada tras {MAX_FLUSH_ATTEMPTS} intentos: {key}")
+                    continue
+                self._pending[key].update(counts)
+
+    def _flush_each(self, pending):
+        """Vuelca fila a fila. Retorna las que fallaron"""
+        failed = {}
+        for key, counts in pending.items():
+            try:
+                upsert_rollups({key: counts})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                failed[key] = counts
+        return failed
+
+    def _start(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # Tras un fork, el hilo del proceso padre no existe en el hijo
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-flush')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(Config.ANALYTICS_FLUSH_SECONDS)
+            self.flush()
+            if time.monotonic() - self._pruned_at >= PRUNE_EVERY_SECONDS:
+                self._pruned_at = time.monotonic()
+                self._prune()
+
+    def _prune(self):
+        """Los rollups por minuto solo se guardan ANALYTICS_MINUTE_RETENTION_DAYS días"""
+        if self.app is None:
+            return
+        cutoff = datetime.utcnow() - timedelta(days=Config.ANALYTICS_MINUTE_RETENTION_DAYS)
+        with self.app.app_context():
+            try:
+                EngagementRollup.query.filter(
+                    EngagementRollup.granularity == 'minute',
+                    EngagementRollup.bucket < cutoff
+                ).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error al limpiar analítica: {e}")
+            finally:
+                db.session.remove()
+
+
+# Acumulador del proceso, alimentado por el envío (mailer) y el tracking (app)
+analytics = RollupAccumulator()
+
+
+# ============ CONSULTAS ============
+
+def _origin(campaign, granularity):
+    """Bucket de referencia de la curva: el del inicio del envío"""
+    if campaign.sent_at:
+        return bucket_start(campaign.sent_at, granularity)
+    first = db.session.query(db.func.min(EngagementRollup.bucket)).filter_by(
+        campaign_id=campaign.id, granularity=granularity
+    ).scalar()
+    return first
+
+
+def engagement_curve(campaign, granularity='hour', since=None):
+    """Contadores por minuto u hora de una campaña, con su desfase desde el envío"""
+    step = GRANULARITIES[granularity]
+    query = EngagementRollup.query.filter_by(campaign_id=campaign.id, granularity=granularity)
+    if since:
+        query = query.filter(EngagementRollup.bucket >= bucket_start(since, granularity))
+    rows = query.order_by(EngagementRollup.bucket).limit(MAX_POINTS).all()
+
+    origin = _origin(campaign, granularity)
+    totals = Counter()
+    points = []
+    for row in rows:
+        counts = {counter: getattr(row, counter) for counter in COUNTERS}
+        totals.update(counts)
+        points.append({
+            'bucket': row.bucket.isoformat(),
+            'offset': int((row.bucket - origin) / step) if origin else None,
+            **counts
+        })
+
+    return {
+        'campaign_id': campaign.id,
+        'granularity': granularity,
+        'origin': origin.isoformat() if origin else None,
+        'points': points,
+        'totals': {counter: totals.get(counter, 0) for counter in COUNTERS}
+    }
+
+
+def compare_campaigns(campaigns, granularity='hour', points=72):
+    """
+    Curvas acumuladas de aperturas y clics únicos de varias campañas, alineadas por el
+    tiempo transcurrido desde su envío (offset 0 = minuto/hora del envío)
+    """
+    step = GRANULARITIES[granularity]
+    result = []
+
+    for campaign in campaigns:
+        origin = _origin(campaign, granularity)
+        sends = db.session.query(db.func.coalesce(db.func.sum(EngagementRollup.sends), 0)).filter_by(
+            campaign_id=campaign.id, granularity='hour'
+        ).scalar()
+        series = []
+
+        if origin:
+            rows = EngagementRollup.query.filter(
+                EngagementRollup.campaign_id == campaign.id,
+                EngagementRollup.granularity == granularity,
+                EngagementRollup.bucket < origin + step * points
+            ).order_by(EngagementRollup.bucket).all()
+
+            opens = clicks = 0
+            for row in rows:
+                opens += row.unique_opens
+                clicks += row.unique_clicks
+                series.append({
+                    'offset': max(0, int((row.bucket - origin) / step)),
+                    'unique_opens': opens,
+                    'unique_clicks': clicks,
+                    'open_rate': round(opens / sends * 100, 2) if sends else 0,
+                    'click_rate': round(clicks / sends * 100, 2) if sends else 0
+                })
+
+        result.append({
+            'campaign_id': campaign.id,
+            'name': campaign.name,
+            'sent_at': campaign.sent_at.isoformat() if campaign.sent_at else None,
+            'sends': sends,
+            'series': series
+        })
+
+    return {'granularity': granularity, 'points': points, 'campaigns': result}
@@ -1,18 +1,20 @@
-from flask import Flask, render_template, request, jsonify, redirect, Response, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, Response, url_for, flash, send_from_directory
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from models import db, Campaign, Recipient
+from models import db, Campaign, Recipient, CampaignSchedule, ImportJob, SendShard, EngagementRollup, ContactList, list_members
 from config import Config
-from datetime import datetime
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import csv
-import io
-import re
-import time
-import threading
+from mailer import prepare_campaign_html, resolve_link, is_known_link
+from scheduler import CampaignScheduler
+from import_jobs import ImportJobRunner
+from sharding import create_shards, close_shards
+from contact_lists import save_campaign_as_list, target_list, clone_campaign, delete_list
+from smtp_pool import smtp_pool
+from analytics import analytics, engagement_curve, compare_campaigns, GRANULARITIES
+from bot_filter import classify_hit, token_cache, TokenInfo
+import profiling
+from datetime import datetime, timezone
 import os
-from urllib.parse import quote, unquote
+import uuid
+import html
 from werkzeug.security import check_password_hash, generate_password_hash
 
 app = Flask(__name__)
@@ -46,140 +48,22 @@ def load_user(user_id):
 with app.app_context():
     db.create_all()
 
+# Contadores de analítica (se vuelcan a engagement_rollups en segundo plano)
+analytics.init_app(app)
 
-def send_email_smtp(recipient, campaign, smtp_connection=None):
-    """Envía un email usando Amazon SES SMTP"""
-    try:
-        # Obtener remitente de la campaña o usar el por defecto
-        sender_email = campaign.sender_email or Config.SENDER_EMAIL
-        sender_name = campaign.sender_name or Config.SENDER_NAME
-        
-        # Crear mensaje
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = campaign.subject
-        msg['From'] = f"{sender_name} <{sender_email}>"
-        msg['To'] = recipient.email
-        
-        # Agregar pixel de tracking y modificar links
-        html_content = add_tracking(campaign.html_content, recipient.tracking_token)
-        
-        # Agregar contenido HTML
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
-        
-        # Usar conexión existente o crear nueva
-        if smtp_connection:
-            smtp_connection.sendmail(sender_email, recipient.email, msg.as_string())
-        else:
-            with smtplib.SMTP(Config.SES_SMTP_HOST, Config.SES_SMTP_PORT) as server:
-                server.starttls()
-                server.login(Config.SES_SMTP_USERNAME, Config.SES_SMTP_PASSWORD)
-                server.sendmail(sender_email, recipient.email, msg.as_string())
-        
-        return True, None
-    except Exception as e:
-        return False, str(e)
+# Tiempos por petición y consultas SQL (solo con PROFILING_ENABLED)
+profiling.init_app(app)
 
+# Scheduler de campañas programadas (se arranca con la primera petición de cada worker)
+scheduler = CampaignScheduler(app)
 
-def get_smtp_connection():
-    """Crear y retornar una conexión SMTP reutilizable"""
-    server = smtplib.SMTP(Config.SES_SMTP_HOST, Config.SES_SMTP_PORT)
-    server.starttls()
-    server.login(Config.SES_SMTP_USERNAME, Config.SES_SMTP_PASSWORD)
-    return server
+# Importaciones de CSV en segundo plano
+import_runner = ImportJobRunner(app)
 
-
-def add_tracking(html_content, tracking_token):
-    """Agrega pixel de tracking para aperturas y modifica links para tracking de clics"""
-    base_url = Config.BASE_URL
-    
-    # Agregar pixel de tracking antes del cierre de </body>
-    tracking_pixel = f'<img src="{base_url}/track/open/{tracking_token}" width="1" height="1" style="display:none;" />'
-    
-    if '</body>' in html_content.lower():
-        html_content = re.sub(
-            r'</body>',
-            f'{tracking_pixel}</body>',
-            html_content,
-            flags=re.IGNORECASE
-        )
-    else:
-        html_content += tracking_pixel
-    
-    # Debug: contar enlaces antes de modificar
-    links_before = len(re.findall(r'<a\s+[^>]*href\s*=\s*["\']?[^"\'>\s]+["\']?[^>]*>', html_content, re.IGNORECASE))
-    
-    # Modificar todos los enlaces <a href="..."> para que pasen por el tracking
-    def replace_link(match):
-        original_tag = match.group(0)
-        # El grupo 3 es el URL (después de href=" o href=')
-        url = match.group(3) if match.lastindex >= 3 else ''
-        
-        if not url:
-            return original_tag
-        
-        # Limpiar el URL de espacios
-        url = url.strip()
-        
-        # No modificar enlaces que ya sean de tracking o enlaces javascript/mailto/data
-        if '/track/' in url or url.startswith(('javascript:', 'mailto:', '#', 'data:', 'vbscript:')):
-            return original_tag
-        
-        # Crear URL de tracking
-        encoded_url = quote(url, safe='')
-        tracking_url = f"{base_url}/track/click/{tracking_token}?url={encoded_url}"
-        
-        # Reemplazar el href en el tag (manejar comillas simples y dobles)
-        quote_char = match.group(2)  # La comilla usada (simple o doble)
-        return original_tag.replace(f'href={quote_char}{url}{quote_char}', f'href={quote_char}{tracking_url}{quote_char}')
-    
-    # Buscar y reemplazar todos los enlaces <a href="...">
-    # Patrón mejorado para capturar href con comillas simples o dobles, y manejar espacios
-    # Patrón: <a ... href=["'](url)["'] ...>
-    html_content = re.sub(
-        r'<a\s+([^>]*\s+)?href\s*=\s*(["\'])([^"\']+)\2([^>]*)>',
-        replace_link,
-        html_content,
-        flags=re.IGNORECASE
-    )
-    
-    # También buscar enlaces sin comillas (menos común pero posible)
-    def replace_link_no_quotes(match):
-        original_tag = match.group(0)
-        url = match.group(2) if match.lastindex >= 2 else ''
-        
-        if not url:
-            return original_tag
-        
-        url = url.strip()
-        
-        # No modificar enlaces que ya sean de tracking o enlaces especiales
-        if '/track/' in url or url.startswith(('javascript:', 'mailto:', '#', 'data:', 'vbscript:')):
-            return original_tag
-        
-        # Crear URL de tracking
-        encoded_url = quote(url, safe='')
-        tracking_url = f"{base_url}/track/click/{tracking_token}?url={encoded_url}"
-        
-        # Reemplazar el href
-        return original_tag.replace(f'href={url}', f'href="{tracking_url}"')
-    
-    # Buscar enlaces sin comillas (href=url sin comillas)
-    html_content = re.sub(
-        r'<a\s+([^>]*\s+)?href\s*=\s*([^\s>]+)([^>]*)>',
-        replace_link_no_quotes,
-        html_content,
-        flags=re.IGNORECASE
-    )
-    
-    # Debug: contar enlaces después de modificar
-    links_after = len(re.findall(r'/track/click/', html_content))
-    
-    # Log para debugging (solo en desarrollo)
-    if app.debug:
-        print(f"Tracking: {links_before} enlaces encontrados, {links_after} enlaces modificados")
-    
-    return html_content
+@app.before_request
+def start_background_workers():
+    scheduler.start()
+    import_runner.maybe_resume()
 
 
 # ============ RUTAS DE AUTENTICACIÓN ============
@@ -237,6 +121,15 @@ def view_campaign(campaign_id):
 
 # ============ API ENDPOINTS ============
 
+def conditional_json(data):
+    """Respuesta JSON con ETag: si el cliente ya tiene esta versión, responde 304 sin cuerpo"""
+    response = jsonify(data)
+    response.add_etag()
+    # El navegador debe revalidar siempre (If-None-Match) en lugar de usar la copia sin preguntar
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @app.route('/api/senders', methods=['GET'])
 @login_required
 def get_senders():
@@ -248,17 +141,32 @@ def get_senders():
 @app.route('/api/campaigns', methods=['GET'])
 @login_required
 def get_campaigns():
-    """Obtener todas las campañas"""
-    campaigns = Campaign.query.order_by(Campaign.created_at.desc()).all()
-    return jsonify([c.to_dict() for c in campaigns])
+    """Obtener todas las campañas (resumen sin html_content, con ETag)"""
+    campaigns = (
+        Campaign.query
+        .options(db.defer(Campaign.html_content))
+        .order_by(Campaign.created_at.desc())
+        .all()
+    )
+    stats = Campaign.stats_by_campaign()
+    empty = Campaign._stats_dict()
+    return conditional_json([c.to_summary_dict(stats.get(c.id, empty)) for c in campaigns])
 
 
 @app.route('/api/campaigns/<campaign_id>', methods=['GET'])
 @login_required
 def get_campaign(campaign_id):
-    """Obtener una campaña específica"""
+    """Obtener una campaña específica (incluye el HTML completo)"""
     campaign = Campaign.query.get_or_404(campaign_id)
-    return jsonify(campaign.to_dict())
+    return conditional_json(campaign.to_dict())
+
+
+@app.route('/api/campaigns/<campaign_id>/summary', methods=['GET'])
+@login_required
+def get_campaign_summary(campaign_id):
+    """Resumen de una campaña sin html_content, para refrescos periódicos"""
+    campaign = Campaign.query.options(db.defer(Campaign.html_content)).filter_by(id=campaign_id).first_or_404()
+    return conditional_json(campaign.to_summary_dict())
 
 
 @app.route('/api/campaigns/<campaign_id>/recipients', methods=['GET'])
@@ -299,10 +207,17 @@ def create_campaign():
             sender_name=data.get('sender_name')
         )
         
+        # Optimizar el HTML una sola vez: el envío ya no procesa HTML por destinatario
+        html_report = prepare_campaign_html(campaign)
+        for warning in html_report['warnings']:
+            print(f"ADVERTENCIA: {warning}")
+        
         db.session.add(campaign)
         db.session.commit()
         
-        return jsonify(campaign.to_dict()), 201
+        response = campaign.to_dict()
+        response['html_report'] = html_report
+        return jsonify(response), 201
     
     except Exception as e:
         db.session.rollback()
@@ -314,7 +229,7 @@ def create_campaign():
 @app.route('/api/campaigns/<campaign_id>/recipients', methods=['POST'])
 @login_required
 def add_recipients(campaign_id):
-    """Agregar recipients desde CSV"""
+    """Agregar recipients desde CSV (se guarda en uploads/ y se importa en segundo plano)"""
     campaign = Campaign.query.get_or_404(campaign_id)
     
     if 'file' not in request.files:
@@ -324,322 +239,229 @@ def add_recipients(campaign_id):
     if file.filename == '':
         return jsonify({'error': 'Archivo vacío'}), 400
     
+    job = ImportJob(campaign_id=campaign.id, filename=file.filename, file_path='')
+    job.id = str(uuid.uuid4())
+    job.file_path = os.path.join(UPLOAD_FOLDER, f'{job.id}.csv')
+    
     try:
-        # Leer CSV con diferentes encodings
-        file_content = file.stream.read()
-        
-        # Intentar diferentes encodings
-        encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'iso-8859-1', 'cp1252']
-        csv_content = None
-        
-        for encoding in encodings:
-            try:
-                csv_content = file_content.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if csv_content is None:
-            return jsonify({'error': 'No se pudo decodificar el archivo CSV. Por favor usa UTF-8.'}), 400
-        
-        # Leer CSV
-        stream = io.StringIO(csv_content)
-        reader = csv.DictReader(stream)
-        
-        # Verificar que el CSV tiene columnas
-        if not reader.fieldnames:
-            return jsonify({'error': 'El archivo CSV está vacío o no tiene encabezados'}), 400
-        
-        # Limpiar BOM de los nombres de columnas (problema común con Excel)
-        cleaned_fieldnames = []
-        fieldname_mapping = {}
-        for field in reader.fieldnames:
-            cleaned = field.strip().lstrip('\ufeff')  # Remover BOM y espacios
-            cleaned_fieldnames.append(cleaned)
-            fieldname_mapping[field] = cleaned
-        
-        # Debug: mostrar columnas detectadas
-        print(f"Columnas detectadas en CSV: {reader.fieldnames}")
-        print(f"Columnas limpiadas: {cleaned_fieldnames}")
-        
-        added = 0
-        skipped = 0
-        errors = []
-        
-        for row_num, row in enumerate(reader, start=2):  # Empezar en 2 porque la línea 1 es el header
-            try:
-                # Limpiar BOM de las claves del row también
-                cleaned_row = {}
-                for key, value in row.items():
-                    cleaned_key = key.strip().lstrip('\ufeff')
-                    cleaned_row[cleaned_key] = value
-                
-                # Detectar columna de email (varios formatos posibles, case-insensitive)
-                email = None
-                for key in cleaned_row.keys():
-                    if key and key.lower().strip() in ['email', 'e-mail', 'correo', 'mail']:
-                        email = cleaned_row.get(key, '').strip()
-                        break
-                
-                # Si no se encontró, intentar con los nombres exactos
-                if not email:
-                    email = (
-                        cleaned_row.get('email', '') or 
-                        cleaned_row.get('Email', '') or 
-                        cleaned_row.get('EMAIL', '') or
-                        cleaned_row.get('e-mail', '') or
-                        cleaned_row.get('E-mail', '') or
-                        cleaned_row.get('Otro e-mail', '') or
-                        cleaned_row.get('correo', '') or
-                        cleaned_row.get('Correo', '') or
-                        ''
-                    ).strip()
-                
-                # Detectar columna de nombre (varios formatos posibles, case-insensitive)
-                name = None
-                for key in cleaned_row.keys():
-                    if key and key.lower().strip() in ['name', 'nombre', 'nombre completo', 'full name']:
-                        name = cleaned_row.get(key, '').strip()
-                        break
-                
-                # Si no se encontró, intentar con los nombres exactos
-                if not name:
-                    name = (
-                        cleaned_row.get('name', '') or 
-                        cleaned_row.get('Name', '') or 
-                        cleaned_row.get('NAME', '') or
-                        cleaned_row.get('nombre', '') or
-                        cleaned_row.get('Nombre', '') or
-                        ''
-                    ).strip()
-                
-                # Validar email
-                if not email:
-                    skipped += 1
-                    continue
-                
-                if '@' not in email:
-                    skipped += 1
-                    continue
-                
-                # Validar formato básico de email
-                if email.count('@') != 1 or '.' not in email.split('@')[1]:
-                    skipped += 1
-                    continue
-                
-                # Crear recipient
-                recipient = Recipient(
-                    campaign_id=campaign.id,
-                    email=email,
-                    name=name if name else None
-                )
-                db.session.add(recipient)
-                added += 1
-                
-            except Exception as e:
-                errors.append(f"Línea {row_num}: {str(e)}")
-                skipped += 1
-                continue
-        
+        file.save(job.file_path)
+        db.session.add(job)
         db.session.commit()
-        
-        print(f"CSV procesado: {added} agregados, {skipped} omitidos")
-        
-        response = {
-            'message': f'Se agregaron {added} destinatarios',
-            'count': added,
-            'skipped': skipped
-        }
-        
-        if errors and len(errors) <= 10:
-            response['errors'] = errors
-        elif errors:
-            response['errors'] = errors[:10]
-            response['error_count'] = len(errors)
-        
-        # Si no se agregó ninguno, dar más información
-        if added == 0:
-            response['warning'] = 'No se agregaron destinatarios. Verifica que el CSV tenga la columna "email" y que los emails sean válidos.'
-            print(f"ADVERTENCIA: No se agregaron destinatarios. Columnas encontradas: {reader.fieldnames}")
-        
-        return jsonify(response)
-    
     except Exception as e:
         db.session.rollback()
         error_msg = str(e)
-        print(f"Error al procesar CSV: {error_msg}")
-        return jsonify({'error': f'Error al procesar el archivo CSV: {error_msg}'}), 400
+        print(f"Error al guardar CSV: {error_msg}")
+        return jsonify({'error': f'Error al guardar el archivo CSV: {error_msg}'}), 500
+    
+    import_runner.start(job.id)
+    
+    response = job.to_dict()
+    response['message'] = 'Archivo recibido. La importación continúa en segundo plano.'
+    return jsonify(response), 202
 
 
-def send_emails_background(campaign_id):
-    """Función para enviar emails en segundo plano con conexión SMTP reutilizada"""
-    with app.app_context():
-        campaign = Campaign.query.get(campaign_id)
-        if not campaign:
-            return
-        
-        # Configuración - SIN pausas artificiales, máxima velocidad
-        BATCH_SIZE = 500                # Reconectar cada 500 emails
-        
-        batch_count = 0
-        pending_recipients = [r for r in campaign.recipients if not r.sent and not r.error_message]
-        smtp_conn = None
-        
+@app.route('/api/campaigns/<campaign_id>/imports', methods=['GET'])
+@login_required
+def get_campaign_imports(campaign_id):
+    """Obtener las importaciones de una campaña"""
+    Campaign.query.get_or_404(campaign_id)
+    jobs = ImportJob.query.filter_by(campaign_id=campaign_id).order_by(ImportJob.created_at.desc()).all()
+    return jsonify([j.to_dict() for j in jobs])
+
+
+@app.route('/api/imports/<job_id>', methods=['GET'])
+@login_required
+def get_import(job_id):
+    """Estado y progreso de una importación"""
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/imports/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_import(job_id):
+    """Cancelar una importación (se conservan los bloques ya confirmados)"""
+    job = ImportJob.query.get_or_404(job_id)
+    
+    if job.status not in ('queued', 'running'):
+        return jsonify({'error': 'La importación ya terminó'}), 400
+    
+    was_queued = job.status == 'queued'
+    job.status = 'cancelled'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    
+    # Si nadie la estaba procesando, el archivo se borra aquí
+    if was_queued:
         try:
-            # Crear conexión SMTP reutilizable
-            smtp_conn = get_smtp_connection()
-            
-            for recipient in pending_recipients:
-                # Verificar si la campaña sigue en estado "sending"
-                db.session.refresh(campaign)
-                if campaign.status != 'sending':
-                    break
-                
-                success, error = send_email_smtp(recipient, campaign, smtp_conn)
-                
-                if success:
-                    recipient.sent = True
-                    recipient.sent_at = datetime.utcnow()
-                else:
-                    recipient.error_message = error
-                    # Si hay error de conexión, reconectar
-                    if 'connection' in str(error).lower() or 'smtp' in str(error).lower():
-                        try:
-                            smtp_conn.quit()
-                        except:
-                            pass
-                        smtp_conn = get_smtp_connection()
-                
-                db.session.commit()
-                batch_count += 1
-                
-                # Reconectar cada BATCH_SIZE para evitar timeouts
-                if batch_count >= BATCH_SIZE:
-                    batch_count = 0
-                    try:
-                        smtp_conn.quit()
-                    except:
-                        pass
-                    smtp_conn = get_smtp_connection()
-        
-        except Exception as e:
-            print(f"Error en envío: {e}")
-        
-        finally:
-            if smtp_conn:
-                try:
-                    smtp_conn.quit()
-                except:
-                    pass
-        
-        # Actualizar estado final
-        total_errors = len([r for r in campaign.recipients if r.error_message])
-        campaign.status = 'sent' if total_errors == 0 else 'sent_with_errors'
-        db.session.commit()
+            os.remove(job.file_path)
+        except OSError:
+            pass
+    
+    return jsonify(job.to_dict())
+
+
+def parse_schedule_options(data):
+    """Valida las opciones de programación. Retorna (opciones, error)"""
+    options = {}
+    
+    scheduled_at = data.get('scheduled_at')
+    if scheduled_at:
+        try:
+            start_at = datetime.fromisoformat(str(scheduled_at).replace('Z', '+00:00'))
+        except ValueError:
+            return None, 'scheduled_at debe ser una fecha ISO 8601'
+        # Guardamos todo en UTC naive, igual que el resto de fechas
+        if start_at.tzinfo:
+            start_at = start_at.astimezone(timezone.utc).replace(tzinfo=None)
+        options['start_at'] = start_at
+    
+    for key in ('window_minutes', 'hourly_cap'):
+        value = data.get(key)
+        if value in (None, ''):
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None, f'{key} debe ser un número entero'
+        if value <= 0:
+            return None, f'{key} debe ser mayor que 0'
+        options[key] = value
+    
+    weight = data.get('weight')
+    if weight not in (None, ''):
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            return None, 'weight debe ser un número'
+        if weight <= 0:
+            return None, 'weight debe ser mayor que 0'
+        options['weight'] = weight
+    
+    return options, None
+
+
+def schedule_campaign(campaign, options):
+    """Crea o actualiza la programación de una campaña y la deja en manos del scheduler"""
+    now = datetime.utcnow()
+    schedule = campaign.schedule
+    
+    if schedule is None:
+        schedule = CampaignSchedule(campaign_id=campaign.id)
+        db.session.add(schedule)
+    elif not options and schedule.end_at and schedule.end_at > now:
+        # Reanudar tras un stop: conservar la hora de fin de la ventana original
+        remaining = (schedule.end_at - now).total_seconds() / 60
+        options = {'window_minutes': max(1, int(remaining + 0.5))}
+    
+    schedule.start_at = max(options.get('start_at', now), now)
+    if 'window_minutes' in options or not options:
+        schedule.window_minutes = options.get('window_minutes')
+    if 'hourly_cap' in options:
+        schedule.hourly_cap = options['hourly_cap']
+    if 'weight' in options:
+        schedule.weight = options['weight']
+    schedule.status = 'pending'
+    
+    campaign.status = 'scheduled'
+    db.session.commit()
+    scheduler.wake()
+    
+    return schedule
 
 
 @app.route('/api/campaigns/<campaign_id>/send', methods=['POST'])
 @login_required
 def send_campaign(campaign_id):
-    """Iniciar envío de campaña en segundo plano"""
+    """Iniciar envío de campaña en segundo plano (inmediato o programado)"""
     campaign = Campaign.query.get_or_404(campaign_id)
     
     if not Config.SES_SMTP_USERNAME or not Config.SES_SMTP_PASSWORD:
         return jsonify({'error': 'Credenciales SES no configuradas'}), 400
     
-    if not campaign.recipients:
+    if campaign.recipients.first() is None:
         return jsonify({'error': 'No hay destinatarios'}), 400
     
     if campaign.status == 'sending':
         return jsonify({'error': 'La campaña ya se está enviando'}), 400
     
-    # Marcar como enviando
-    campaign.status = 'sending'
-    campaign.sent_at = datetime.utcnow()
-    db.session.commit()
+    data = request.get_json(silent=True) or {}
+    options, error = parse_schedule_options(data)
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Iniciar envío en segundo plano
-    thread = threading.Thread(target=send_emails_background, args=(campaign_id,))
-    thread.daemon = True
-    thread.start()
-    
-    pending = len([r for r in campaign.recipients if not r.sent and not r.error_message])
+    pending = campaign.recipients.filter_by(sent=False, error_message=None).count()
     
+    # Envío repartido en shards: lo hacen los nodos de sender_node.py, no este proceso
+    if data.get('sharded'):
+        try:
+            shard_count = int(data.get('shards', 4))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'shards debe ser un número entero'}), 400
+        if not 1 <= shard_count <= Config.SHARD_MAX_COUNT:
+            return jsonify({'error': f'shards debe estar entre 1 y {Config.SHARD_MAX_COUNT}'}), 400
+        # El scheduler activaría la programación y enviaría los mismos recipients que los nodos
+        if campaign.schedule and campaign.schedule.status in ('pending', 'active'):
+            return jsonify({'error': 'La campaña tiene un envío programado: detenlo antes de repartirlo en shards'}), 400
+        
+        create_shards(campaign, shard_count)
+        campaign.status = 'sending'
+        campaign.sent_at = campaign.sent_at or datetime.utcnow()
+        db.session.commit()
+        return jsonify({
+            'message': f'Envío repartido en {shard_count} shards para {pending} destinatarios. Los nodos de envío los irán tomando.',
+            'pending': pending,
+            'status': 'sending',
+            'shards': shard_count
+        })
+    
+    # Una campaña enviada antes por shards: los nodos retomarían sus shards abiertos y
+    # enviarían los mismos recipients
+    if not close_shards(campaign):
+        return jsonify({'error': 'Un nodo de envío aún tiene un shard de la campaña: inténtalo en unos segundos'}), 400
+    
+    # Todo envío que no va por shards lo hace el scheduler, el único que aplica el límite
+    # SES_MAX_SEND_RATE de la cuenta (un solo proceso del servidor envía). Sin opciones
+    # empieza ya y sin ventana; al reanudar conserva la programación que tenía.
+    schedule = schedule_campaign(campaign, options)
+    if not options:
+        return jsonify({
+            'message': f'Envío iniciado para {pending} destinatarios. El proceso continuará en segundo plano.',
+            'pending': pending,
+            'status': 'scheduled'
+        })
     return jsonify({
-        'message': f'Envío iniciado para {pending} destinatarios. El proceso continuará en segundo plano.',
+        'message': f'Envío programado para {pending} destinatarios a partir de {schedule.start_at.isoformat()} UTC.',
         'pending': pending,
-        'status': 'sending'
+        'status': 'scheduled',
+        'schedule': schedule.to_dict()
     })
 
 
+@app.route('/api/campaigns/<campaign_id>/shards', methods=['GET'])
+@login_required
+def get_campaign_shards(campaign_id):
+    """Progreso del envío por shard (campañas enviadas con sharded)"""
+    Campaign.query.get_or_404(campaign_id)
+    shards = SendShard.query.filter_by(campaign_id=campaign_id).order_by(SendShard.shard_index)
+    return jsonify([shard.to_dict() for shard in shards])
+
+
 @app.route('/api/campaigns/<campaign_id>', methods=['DELETE'])
 @login_required
 def delete_campaign(campaign_id):
     """Eliminar una campaña"""
     campaign = Campaign.query.get_or_404(campaign_id)
+    # Un solo DELETE para todos los recipients, sin cargarlos en memoria
+    Recipient.query.filter_by(campaign_id=campaign.id).delete(synchronize_session=False)
+    EngagementRollup.query.filter_by(campaign_id=campaign.id).delete(synchronize_session=False)
     db.session.delete(campaign)
     db.session.commit()
+    analytics.discard(campaign_id)
+    token_cache.evict_campaign(campaign_id)
     return jsonify({'message': 'Campaña eliminada'})
 
 
-def retry_emails_background(campaign_id):
-    """Reintentar envíos fallidos en segundo plano con conexión reutilizada"""
-    with app.app_context():
-        campaign = Campaign.query.get(campaign_id)
-        if not campaign:
-            return
-        
-        BATCH_SIZE = 500
-        batch_count = 0
-        failed_recipients = [r for r in campaign.recipients if r.error_message and not r.sent]
-        smtp_conn = None
-        
-        try:
-            smtp_conn = get_smtp_connection()
-            
-            for recipient in failed_recipients:
-                db.session.refresh(campaign)
-                if campaign.status != 'sending':
-                    break
-                
-                recipient.error_message = None
-                success, error = send_email_smtp(recipient, campaign, smtp_conn)
-                
-                if success:
-                    recipient.sent = True
-                    recipient.sent_at = datetime.utcnow()
-                else:
-                    recipient.error_message = error
-                    if 'connection' in str(error).lower():
-                        try:
-                            smtp_conn.quit()
-                        except:
-                            pass
-                        smtp_conn = get_smtp_connection()
-                
-                db.session.commit()
-                batch_count += 1
-                
-                if batch_count >= BATCH_SIZE:
-                    batch_count = 0
-                    try:
-                        smtp_conn.quit()
-                    except:
-                        pass
-                    smtp_conn = get_smtp_connection()
-        
-        finally:
-            if smtp_conn:
-                try:
-                    smtp_conn.quit()
-                except:
-                    pass
-        
-        total_errors = len([r for r in campaign.recipients if r.error_message])
-        campaign.status = 'sent' if total_errors == 0 else 'sent_with_errors'
-        db.session.commit()
-
-
 @app.route('/api/campaigns/<campaign_id>/retry', methods=['POST'])
 @login_required
 def retry_failed(campaign_id):
@@ -649,7 +471,10 @@ def retry_failed(campaign_id):
     if not Config.SES_SMTP_USERNAME or not Config.SES_SMTP_PASSWORD:
         return jsonify({'error': 'Credenciales SES no configuradas'}), 400
     
-    failed_count = len([r for r in campaign.recipients if r.error_message and not r.sent])
+    failed_count = campaign.recipients.filter(
+        Recipient.error_message != None,
+        Recipient.sent == False
+    ).count()
     
     if failed_count == 0:
         return jsonify({'error': 'No hay envíos fallidos para reintentar'}), 400
@@ -657,17 +482,25 @@ def retry_failed(campaign_id):
     if campaign.status == 'sending':
         return jsonify({'error': 'Ya hay un envío en progreso'}), 400
     
-    campaign.status = 'sending'
-    db.session.commit()
+    # Con una programación en curso los fallidos se reintentarían fuera de su ventana
+    if campaign.status == 'scheduled' or (campaign.schedule and campaign.schedule.status in ('pending', 'active')):
+        return jsonify({'error': 'La campaña tiene un envío programado: reintenta los fallidos cuando termine'}), 400
+    
+    if not close_shards(campaign):
+        return jsonify({'error': 'Un nodo de envío aún tiene un shard de la campaña: inténtalo en unos segundos'}), 400
     
-    thread = threading.Thread(target=retry_emails_background, args=(campaign_id,))
-    thread.daemon = True
-    thread.start()
+    # Sin error vuelven a estar pendientes: el scheduler los envía con el rate de la cuenta
+    Recipient.query.filter(
+        Recipient.campaign_id == campaign.id,
+        Recipient.error_message != None,
+        Recipient.sent == False
+    ).update({'error_message': None}, synchronize_session=False)
+    schedule_campaign(campaign, {})
     
     return jsonify({
         'message': f'Reintentando {failed_count} envíos fallidos en segundo plano.',
         'retrying': failed_count,
-        'status': 'sending'
+        'status': 'scheduled'
     })
 
 
@@ -677,7 +510,7 @@ def stop_campaign(campaign_id):
     """Detener el envío de una campaña"""
     campaign = Campaign.query.get_or_404(campaign_id)
     
-    if campaign.status != 'sending':
+    if campaign.status not in ('sending', 'scheduled'):
         return jsonify({'error': 'La campaña no está en envío'}), 400
     
     campaign.status = 'stopped'
@@ -686,40 +519,174 @@ def stop_campaign(campaign_id):
     return jsonify({'message': 'Envío detenido. Puedes reanudarlo después.'})
 
 
+# ============ LISTAS DE CONTACTOS ============
+
+@app.route('/api/lists', methods=['GET'])
+@login_required
+def get_lists():
+    """Listas de contactos con su tamaño (una consulta agrupada)"""
+    counts = dict(
+        db.session.query(list_members.c.list_id, db.func.count()).group_by(list_members.c.list_id)
+    )
+    lists = ContactList.query.order_by(ContactList.created_at.desc()).all()
+    return jsonify([contact_list.to_dict(counts.get(contact_list.id, 0)) for contact_list in lists])
+
+
+@app.route('/api/lists/<list_id>', methods=['DELETE'])
+@login_required
+def delete_contact_list(list_id):
+    """Eliminar una lista (los contactos y las campañas enviadas se conservan)"""
+    contact_list = ContactList.query.get_or_404(list_id)
+    delete_list(contact_list)
+    db.session.commit()
+    return jsonify({'message': 'Lista eliminada'})
+
+
+@app.route('/api/campaigns/<campaign_id>/save-list', methods=['POST'])
+@login_required
+def save_as_list(campaign_id):
+    """Guardar los destinatarios de la campaña como lista reutilizable"""
+    campaign = Campaign.query.get_or_404(campaign_id)
+    data = request.get_json(silent=True) or {}
+    name = (data.get('name') or '').strip() or campaign.name
+    
+    if campaign.recipients.first() is None:
+        return jsonify({'error': 'No hay destinatarios'}), 400
+    
+    contact_list = save_campaign_as_list(campaign, name)
+    db.session.commit()
+    return jsonify(contact_list.to_dict()), 201
+
+
+@app.route('/api/campaigns/<campaign_id>/target-list', methods=['POST'])
+@login_required
+def set_target_list(campaign_id):
+    """Usar una lista como destinatarios de una campaña en borrador"""
+    campaign = Campaign.query.get_or_404(campaign_id)
+    data = request.get_json(silent=True) or {}
+    
+    contact_list = db.session.get(ContactList, data.get('list_id') or '')
+    if contact_list is None:
+        return jsonify({'error': 'Lista no encontrada'}), 400
+    
+    if campaign.status != 'draft':
+        return jsonify({'error': 'Solo se puede elegir la lista de una campaña en borrador'}), 400
+    
+    if campaign.recipients.first() is not None:
+        return jsonify({'error': 'La campaña ya tiene destinatarios'}), 400
+    
+    added = target_list(campaign, contact_list)
+    db.session.commit()
+    return jsonify({'message': f'{added} destinatarios agregados', 'recipients_added': added, 'list_id': contact_list.id})
+
+
+@app.route('/api/campaigns/<campaign_id>/clone', methods=['POST'])
+@login_required
+def duplicate_campaign(campaign_id):
+    """Duplicar una campaña (contenido y destinatarios, sin el estado de envío)"""
+    campaign = Campaign.query.get_or_404(campaign_id)
+    data = request.get_json(silent=True) or {}
+    
+    duplicate = clone_campaign(campaign, (data.get('name') or '').strip() or None)
+    db.session.commit()
+    return jsonify(duplicate.to_dict()), 201
+
+
 # ============ TRACKING ENDPOINTS ============
 
+def load_token(tracking_token):
+    """Datos del recipient que necesita el tracking (para la cache de tokens)"""
+    row = db.session.query(
+        Recipient.id, Recipient.campaign_id, Recipient.sent_at, Recipient.opened_at, Recipient.clicked_at
+    ).filter_by(tracking_token=tracking_token).first()
+    if row is None:
+        return None
+    return TokenInfo(row.id, row.campaign_id, row.sent_at, row.opened_at is not None, row.clicked_at is not None)
+
+
+def is_machine_hit(info, kind):
+    """Clasifica la visita actual (proxy de privacidad, escáner, bot) sin tocar la base de datos"""
+    ip = request.headers.get('X-Real-IP') or request.remote_addr
+    return classify_hit(kind, request.user_agent.string, ip, info.sent_at) is not None
+
+
 @app.route('/track/open/<tracking_token>')
 def track_open(tracking_token):
-    """Registrar apertura de email"""
-    recipient = Recipient.query.filter_by(tracking_token=tracking_token).first()
-    
-    if recipient and not recipient.opened_at:
-        recipient.opened_at = datetime.utcnow()
-        db.session.commit()
+    """Registrar apertura de email (las automáticas solo cuentan en la analítica)"""
+    info = token_cache.get(tracking_token, load_token)
+    
+    if info and is_machine_hit(info, 'open'):
+        analytics.record(info.campaign_id, 'machine_opens')
+    elif info:
+        first_open = False
+        if not info.opened:
+            # Condicional: otro worker pudo registrar la apertura primero
+            first_open = Recipient.query.filter(
+                Recipient.id == info.recipient_id, Recipient.opened_at == None
+            ).update({'opened_at': datetime.utcnow()}, synchronize_session=False) == 1
+            db.session.commit()
+            info.opened = True
+        analytics.record(info.campaign_id, 'opens', unique=first_open)
     
     # Retornar imagen transparente 1x1
     transparent_pixel = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b'
     return Response(transparent_pixel, mimetype='image/gif')
 
 
+def record_click(info):
+    """Registrar el clic (aunque ya haya hecho clic antes, actualizamos la fecha)"""
+    if is_machine_hit(info, 'click'):
+        # Escáner de enlaces: se redirige igual, pero no cuenta como clic del destinatario
+        analytics.record(info.campaign_id, 'machine_clicks')
+        return
+    
+    now = datetime.utcnow()
+    first_click = not info.clicked and Recipient.query.filter(
+        Recipient.id == info.recipient_id, Recipient.clicked_at == None
+    ).update({'clicked_at': now}, synchronize_session=False) == 1
+    if not first_click:
+        Recipient.query.filter_by(id=info.recipient_id).update({'clicked_at': now}, synchronize_session=False)
+    db.session.commit()
+    info.clicked = True
+    analytics.record(info.campaign_id, 'clicks', unique=first_click)
+
+
+@app.route('/c/<tracking_token>/<int:link_id>')
+def track_link(tracking_token, link_id):
+    """Registrar clic en un enlace corto y redirigir a su destino en la tabla de enlaces"""
+    info = token_cache.get(tracking_token, load_token)
+    if not info:
+        return redirect('/')
+    
+    url = resolve_link(info.campaign_id, link_id)
+    if not url:
+        return redirect('/')
+    
+    record_click(info)
+    return redirect(url)
+
+
 @app.route('/track/click/<tracking_token>')
 def track_click(tracking_token):
-    """Registrar clic en link"""
-    recipient = Recipient.query.filter_by(tracking_token=tracking_token).first()
+    """Registrar clic en link (formato antiguo con ?url=, emails ya enviados)"""
+    info = token_cache.get(tracking_token, load_token)
     
-    if recipient:
-        # Registrar el clic (aunque ya haya hecho clic antes, actualizamos la fecha)
-        recipient.clicked_at = datetime.utcnow()
-        db.session.commit()
+    # Werkzeug ya decodificó el parámetro; los enlaces se guardaron sin decodificar, tal
+    # como estaban en el HTML (con &amp; si el editor lo escapó)
+    original_url = html.unescape(request.args.get('url', '/'))
     
-    # Redirigir al URL original
-    original_url = request.args.get('url', '/')
-    original_url = unquote(original_url)
+    # Solo se redirige a enlaces que estén en el email de la campaña: evita usar
+    # este endpoint como redirección abierta hacia cualquier sitio. La campaña puede no
+    # existir si se eliminó y otro worker aún tiene el token en su cache
+    campaign = db.session.get(Campaign, info.campaign_id) if info else None
+    if campaign is None or not is_known_link(campaign, original_url):
+        return redirect('/')
     
     # Validar que la URL sea segura (no javascript: ni data:)
     if original_url.startswith(('javascript:', 'data:', 'vbscript:')):
-        original_url = '/'
+        return redirect('/')
     
+    record_click(info)
     return redirect(original_url)
 
 
@@ -744,6 +711,101 @@ def get_stats():
     })
 
 
+def parse_granularity():
+    """Granularidad de la analítica desde ?granularity= (hour por defecto). Retorna (granularidad, error)"""
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        return None, 'granularity debe ser minute u hour'
+    return granularity, None
+
+
+@app.route('/api/campaigns/<campaign_id>/engagement')
+@login_required
+def get_campaign_engagement(campaign_id):
+    """Curva de envíos, aperturas y clics por minuto u hora desde el envío"""
+    campaign = db.session.query(Campaign).options(db.defer(Campaign.html_content)).filter_by(id=campaign_id).first_or_404()
+    
+    granularity, error = parse_granularity()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since.replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({'error': 'since debe ser una fecha ISO 8601'}), 400
+        if since.tzinfo:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    return conditional_json(engagement_curve(campaign, granularity, since))
+
+
+@app.route('/api/analytics/compare')
+@login_required
+def compare_engagement():
+    """Aperturas y clics acumulados de varias campañas alineados desde su envío"""
+    granularity, error = parse_granularity()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        points = int(request.args.get('points', 72))
+    except ValueError:
+        return jsonify({'error': 'points debe ser un número entero'}), 400
+    points = max(1, min(points, 2000))
+    
+    query = db.session.query(Campaign).options(db.defer(Campaign.html_content))
+    ids = [i for i in request.args.get('campaign_ids', '').split(',') if i]
+    if ids:
+        campaigns = query.filter(Campaign.id.in_(ids[:10])).all()
+    else:
+        # Por defecto, las últimas 5 campañas enviadas
+        campaigns = query.filter(Campaign.sent_at != None).order_by(Campaign.sent_at.desc()).limit(5).all()
+    
+    return conditional_json(compare_campaigns(campaigns, granularity, points))
+
+
+@app.route('/api/smtp/pool')
+@login_required
+def get_smtp_pool_stats():
+    """Estado del pool de conexiones SMTP de este proceso"""
+    return jsonify(smtp_pool.stats())
+
+
+@app.route('/api/profiling')
+@login_required
+def get_profiling():
+    """Estado de la instrumentación y perfiles del envío disponibles"""
+    return jsonify({
+        'enabled': Config.PROFILING_ENABLED,
+        'slow_request_ms': Config.SLOW_REQUEST_MS,
+        'sender_sampler': profiling.sampler_enabled(),
+        'profiles': profiling.list_profiles()
+    })
+
+
+@app.route('/api/profiling/sampler', methods=['POST'])
+@login_required
+def toggle_sender_sampler():
+    """Activar o desactivar el muestreo de los próximos envíos (en todos los workers)"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('enabled'), bool):
+        return jsonify({'error': 'enabled debe ser true o false'}), 400
+    
+    profiling.set_sampler(data['enabled'])
+    return jsonify({'sender_sampler': profiling.sampler_enabled()})
+
+
+@app.route('/api/profiling/profiles/<name>')
+@login_required
+def download_profile(name):
+    """Descargar un perfil en formato collapsed stacks (flamegraph.pl, speedscope)"""
+    if not name.endswith(profiling.PROFILE_SUFFIX):
+        return jsonify({'error': 'Perfil no encontrado'}), 404
+    return send_from_directory(profiling.profile_dir(), name, as_attachment=True, mimetype='text/plain')
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5010)
 
@@ -0,0 +1,214 @@
+"""
+Clasificación de las visitas de tracking (aperturas y clics) en humanas o automáticas.
+
+Apple Mail Privacy Protection descarga el pixel de todos los emails al entregarlos, y los
+escáneres de enlaces corporativos (Microsoft Defender, Proofpoint, Mimecast, Barracuda...)
+visitan los enlaces antes que el destinatario. Una visita se considera automática si:
+
+- su user-agent coincide con el patrón precompilado de bots, escáneres y clientes HTTP,
+- su IP está en un rango conocido de proxies de privacidad o escáneres (búsqueda
+  binaria sobre rangos ordenados),
+- llega demasiado pronto tras el envío del email, o
+- su IP acumula una ráfaga de visitas en la ventana reciente en memoria.
+
+Todo se evalúa en memoria (microsegundos por visita). La información del token
+(recipient, campaña, fecha de envío) se cachea en un LRU para no consultar la base de
+datos en cada visita repetida.
+"""
+
+from config import Config
+from collections import OrderedDict, deque
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+import ipaddress
+import re
+import threading
+import time
+
+
+BOT_USER_AGENT_PATTERNS = [
+    r'bot\b', r'crawler', r'spider', r'preview', r'scanner', r'headless',
+    r'python-requests', r'python-urllib', r'aiohttp', r'go-http-client', r'java/', r'okhttp',
+    r'curl/', r'wget', r'libwww', r'httpclient', r'node-fetch', r'axios',
+    r'barracuda', r'proofpoint', r'mimecast', r'symantec', r'forcepoint', r'trend ?micro',
+    r'zscaler', r'sophos', r'fortiguard', r'cisco', r'ironport', r'messagelabs',
+    r'skypeuripreview', r'bingpreview',
+    r'facebookexternalhit', r'slackbot', r'linkedinbot', r'whatsapp', r'telegrambot',
+]
+
+# Apple MPP descarga el pixel con un user-agent reducido a "Mozilla/5.0"
+APPLE_PROXY_USER_AGENT = 'Mozilla/5.0'
+
+BOT_IP_RANGES = [
+    '17.0.0.0/8',          # Apple (Mail Privacy Protection)
+    '40.92.0.0/15',        # Microsoft Exchange Online Protection
+    '40.107.0.0/16',
+    '52.100.0.0/14',
+    '104.47.0.0/17',
+    '67.231.144.0/20',     # Proofpoint
+    '148.163.128.0/19',
+    '205.139.110.0/24',    # Mimecast
+    '207.211.30.0/24',
+    '64.235.144.0/20',     # Barracuda
+    '209.222.80.0/21',
+]
+
+
+def _compile_user_agents():
+    # Se compara contra el user-agent en minúsculas: más rápido que IGNORECASE
+    patterns = BOT_USER_AGENT_PATTERNS + [p for p in Config.BOT_EXTRA_USER_AGENTS.split(',') if p.strip()]
+    return re.compile('|'.join(f'(?:{p.strip().lower()})' for p in patterns))
+
+
+def _build_ranges():
+    """Rangos de IP como listas ordenadas de (inicio, fin) enteros, por versión"""
+    cidrs = BOT_IP_RANGES + [c.strip() for c in Config.BOT_EXTRA_IP_RANGES.split(',') if c.strip()]
+    ranges = {4: [], 6: []}
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr, strict=False)
+        ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+    merged = {}
+    for version, items in ranges.items():
+        items.sort()
+        result = []
+        for start, end in items:
+            if result and start <= result[-1][1] + 1:
+                result[-1] = (result[-1][0], max(result[-1][1], end))
+            else:
+                result.append((start, end))
+        merged[version] = ([start for start, _ in result], [end for _, end in result])
+    return merged
+
+
+USER_AGENT_MATCHER = _compile_user_agents()
+IP_RANGES = _build_ranges()
+
+
+@lru_cache(maxsize=4096)
+def is_bot_user_agent(user_agent):
+    """Los user-agents se repiten mucho: el resultado del regex se cachea por cadena"""
+    user_agent = user_agent.strip()
+    return (
+        not user_agent or user_agent == APPLE_PROXY_USER_AGENT or
+        USER_AGENT_MATCHER.search(user_agent.lower()) is not None
+    )
+
+
+@lru_cache(maxsize=16384)
+def ip_in_bot_ranges(ip):
+    if not ip:
+        return False
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    starts, ends = IP_RANGES[address.version]
+    index = bisect_right(starts, int(address)) - 1
+    return index >= 0 and int(address) <= ends[index]
+
+
+class RecentHits:
+    """Visitas recientes por IP en una ventana deslizante (solo memoria, acotada)"""
+
+    MAX_IPS = 50000
+
+    def __init__(self, window_seconds):
+        self.window = window_seconds
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def add(self, ip, now):
+        """Registra la visita y retorna cuántas lleva la IP dentro de la ventana"""
+        with self._lock:
+            hits = self._hits.get(ip)
+            if hits is None:
+                if len(self._hits) >= self.MAX_IPS:
+                    self._prune(now)
+                hits = self._hits[ip] = deque()
+            hits.append(now)
+            while hits and now - hits[0] > self.window:
+                hits.popleft()
+            return len(hits)
+
+    def _prune(self, now):
+        for ip in [ip for ip, hits in self._hits.items() if not hits or now - hits[-1] > self.window]:
+            del self._hits[ip]
+        # Si todas están activas (ataque), se descarta la mitad más antigua
+        if len(self._hits) >= self.MAX_IPS:
+            for ip in list(self._hits)[:self.MAX_IPS // 2]:
+                del self._hits[ip]
+
+
+_recent_hits = RecentHits(Config.BOT_BURST_WINDOW_SECONDS)
+
+
+def classify_hit(kind, user_agent, ip, sent_at, now=None):
+    """
+    Retorna None si la visita parece humana, o el motivo ('user_agent', 'ip_range',
+    'too_soon', 'burst') si parece automática. `kind` es 'open' o 'click'.
+    """
+    if is_bot_user_agent(user_agent or ''):
+        return 'user_agent'
+
+    if ip_in_bot_ranges(ip):
+        return 'ip_range'
+
+    now = now or datetime.utcnow()
+    if sent_at:
+        min_seconds = Config.BOT_MIN_OPEN_SECONDS if kind == 'open' else Config.BOT_MIN_CLICK_SECONDS
+        if (now - sent_at).total_seconds() < min_seconds:
+            return 'too_soon'
+
+    if ip and _recent_hits.add(ip, time.monotonic()) > Config.BOT_IP_BURST:
+        return 'burst'
+
+    return None
+
+
+# ============ CACHE DE TOKENS ============
+
+class TokenInfo:
+    __slots__ = ('recipient_id', 'campaign_id', 'sent_at', 'opened', 'clicked')
+
+    def __init__(self, recipient_id, campaign_id, sent_at, opened, clicked):
+        self.recipient_id = recipient_id
+        self.campaign_id = campaign_id
+        self.sent_at = sent_at
+        self.opened = opened
+        self.clicked = clicked
+
+
+class TokenCache:
+    """LRU tracking_token -> TokenInfo; `loader(token)` consulta la base de datos en un fallo"""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token, loader):
+        with self._lock:
+            info = self._items.get(token)
+            if info is not None:
+                self._items.move_to_end(token)
+                return info
+
+        info = loader(token)
+        if info is None:
+            return None
+        with self._lock:
+            self._items[token] = info
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return info
+
+    def evict_campaign(self, campaign_id):
+        """Olvida los tokens de una campaña (al eliminarla)"""
+        with self._lock:
+            for token in [token for token, info in self._items.items() if info.campaign_id == campaign_id]:
+                del self._items[token]
+
+
+token_cache = TokenCache(Config.TRACKING_TOKEN_CACHE_SIZE)
@@ -9,6 +9,66 @@ class Config:
     SES_SMTP_PORT = int(os.getenv('SES_SMTP_PORT', 587))
     SES_SMTP_USERNAME = os.getenv('SES_SMTP_USERNAME', '')
     SES_SMTP_PASSWORD = os.getenv('SES_SMTP_PASSWORD', '')
+    # Desactivar solo para pruebas locales contra un servidor SMTP sin TLS (stub_smtp_server.py)
+    SES_SMTP_STARTTLS = os.getenv('SES_SMTP_STARTTLS', 'true').lower() not in ('0', 'false', 'no')
+    
+    # Pool de conexiones SMTP del proceso (smtp_pool.py)
+    SMTP_POOL_MAX_IDLE = int(os.getenv('SMTP_POOL_MAX_IDLE', 4))  # Conexiones inactivas conservadas
+    SMTP_POOL_MAX_MESSAGES = int(os.getenv('SMTP_POOL_MAX_MESSAGES', 500))  # Reciclar tras N mensajes
+    SMTP_POOL_MAX_AGE = float(os.getenv('SMTP_POOL_MAX_AGE', 900))  # segundos de vida máxima
+    SMTP_POOL_IDLE_TIMEOUT = float(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 300))  # Cerrar si no se usa
+    SMTP_POOL_NOOP_AFTER = float(os.getenv('SMTP_POOL_NOOP_AFTER', 10))  # NOOP antes de reusar tras N s
+    SMTP_POOL_KEEPALIVE = float(os.getenv('SMTP_POOL_KEEPALIVE', 30))  # NOOP periódico a las inactivas
+    
+    # Límite global de envío de la cuenta SES (mensajes por segundo), compartido entre campañas.
+    # Lo aplica el scheduler a todos los envíos del servidor; los nodos de shards van aparte
+    SES_MAX_SEND_RATE = float(os.getenv('SES_MAX_SEND_RATE', 14))
+    
+    # Ritmo por dominio del destinatario (mensajes/segundo), ajustado con los diferimientos 4xx
+    DOMAIN_INITIAL_RATE = float(os.getenv('DOMAIN_INITIAL_RATE', 5))
+    DOMAIN_MIN_RATE = float(os.getenv('DOMAIN_MIN_RATE', 0.2))
+    DOMAIN_MAX_RATE = float(os.getenv('DOMAIN_MAX_RATE', 50))
+    DOMAIN_RATE_STEP = float(os.getenv('DOMAIN_RATE_STEP', 0.1))
+    DOMAIN_MAX_CONCURRENCY = int(os.getenv('DOMAIN_MAX_CONCURRENCY', 2))
+    DOMAIN_DEFERRAL_BACKOFF = float(os.getenv('DOMAIN_DEFERRAL_BACKOFF', 30))  # segundos
+    DOMAIN_SLOT_TIMEOUT = float(os.getenv('DOMAIN_SLOT_TIMEOUT', 180))  # Hueco sin resultado = libre
+    # Pendientes leídos por adelantado en cada envío (la memoria no depende del tamaño de la campaña)
+    SEND_LOOKAHEAD = int(os.getenv('SEND_LOOKAHEAD', 5000))
+    
+    # Envío repartido en shards entre nodos (sender_node.py)
+    SHARD_LEASE_SECONDS = float(os.getenv('SHARD_LEASE_SECONDS', 30))  # Sin renovar = nodo caído
+    SHARD_MAX_COUNT = int(os.getenv('SHARD_MAX_COUNT', 256))
+    # Rate de cada nodo, fuera del límite del scheduler: nodos × SENDER_NODE_SEND_RATE más
+    # SES_MAX_SEND_RATE (si el servidor envía a la vez) no debe superar el límite de la cuenta
+    SENDER_NODE_SEND_RATE = float(os.getenv('SENDER_NODE_SEND_RATE', SES_MAX_SEND_RATE))
+    
+    # Analítica: los contadores se acumulan en memoria y se vuelcan cada N segundos
+    ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', 5))
+    ANALYTICS_MINUTE_RETENTION_DAYS = int(os.getenv('ANALYTICS_MINUTE_RETENTION_DAYS', 14))
+    
+    # Filtro de visitas automáticas al tracking (bot_filter.py)
+    BOT_MIN_OPEN_SECONDS = float(os.getenv('BOT_MIN_OPEN_SECONDS', 2))  # Apertura antes = automática
+    BOT_MIN_CLICK_SECONDS = float(os.getenv('BOT_MIN_CLICK_SECONDS', 10))  # Clic antes = escáner
+    BOT_BURST_WINDOW_SECONDS = float(os.getenv('BOT_BURST_WINDOW_SECONDS', 10))
+    BOT_IP_BURST = int(os.getenv('BOT_IP_BURST', 20))  # Visitas de una IP dentro de la ventana
+    BOT_EXTRA_USER_AGENTS = os.getenv('BOT_EXTRA_USER_AGENTS', '')  # Regex separadas por comas
+    BOT_EXTRA_IP_RANGES = os.getenv('BOT_EXTRA_IP_RANGES', '')  # CIDR separados por comas
+    TRACKING_TOKEN_CACHE_SIZE = int(os.getenv('TRACKING_TOKEN_CACHE_SIZE', 100000))
+    
+    # Validación de emails al importar (email_validation.py). La comprobación de MX usa DNS
+    EMAIL_MX_CHECK = os.getenv('EMAIL_MX_CHECK', 'false').lower() in ('1', 'true', 'yes')
+    MX_CHECK_WORKERS = int(os.getenv('MX_CHECK_WORKERS', 16))  # Consultas DNS en paralelo
+    MX_CHECK_TIMEOUT = float(os.getenv('MX_CHECK_TIMEOUT', 3))  # segundos por consulta
+    MX_CACHE_TTL_HOURS = float(os.getenv('MX_CACHE_TTL_HOURS', 168))  # Dominios que reciben correo
+    MX_NEGATIVE_TTL_HOURS = float(os.getenv('MX_NEGATIVE_TTL_HOURS', 24))  # Dominios sin correo
+    
+    # Instrumentación (profiling.py), desactivada por defecto
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))  # Peticiones más lentas se registran
+    PROFILE_LOG_EVERY = int(os.getenv('PROFILE_LOG_EVERY', 1000))  # Mensajes por log de etapas
+    PROFILE_SENDER = os.getenv('PROFILE_SENDER', 'false').lower() in ('1', 'true', 'yes')
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 10))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
     
     # Sender configuration - Multiple senders
     # Sender 1 (default)
@@ -51,7 +111,8 @@ class Config:
     ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', "ViDH3<#2;vld5P'>Q6'>DE$z")
     
     # Database
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///email_campaigns.db'
+    # Los nodos de envío en otras máquinas necesitan una base de datos compartida
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///email_campaigns.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
@@ -0,0 +1,130 @@
+"""
+Listas de contactos reutilizables.
+
+Cada email vive una sola vez en `contacts` y las listas lo referencian desde `list_members`.
+Una campaña que usa una lista solo guarda el estado de envío de cada destinatario
+(`recipients`), que se crea con un único INSERT ... SELECT: lanzar una campaña a una lista
+de 500.000 contactos es una sentencia SQL, sin subir ni procesar el CSV otra vez. Los ids
+y tokens de tracking de los recipients se generan en la propia base de datos.
+"""
+
+from models import db, Campaign, Recipient, Contact, ContactList, CampaignLink, list_members
+from datetime import datetime
+from sqlalchemy import select, exists, literal, false
+
+
+def random_id():
+    """Id aleatorio generado por la base de datos (para insertar filas desde un SELECT)"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return db.func.lower(db.func.hex(db.func.randomblob(16)))
+    if dialect == 'postgresql':
+        return db.cast(db.func.gen_random_uuid(), db.String)
+    return db.func.uuid()
+
+
+def save_campaign_as_list(campaign, name):
+    """
+    Crea una lista con los destinatarios de la campaña. Los emails que ya eran contactos
+    se reutilizan; los nuevos se agregan a `contacts` una sola vez.
+    """
+    now = datetime.utcnow()
+    email = db.func.lower(Recipient.email)
+
+    # Contactos nuevos (un email repetido en la campaña se agrega una vez)
+    db.session.execute(
+        db.insert(Contact).from_select(
+            ['id', 'email', 'name', 'domain', 'created_at'],
+            select(random_id(), email, db.func.max(Recipient.name), db.func.max(Recipient.domain), literal(now))
+            .where(
+                Recipient.campaign_id == campaign.id,
+                ~exists().where(Contact.email == email)
+            )
+            .group_by(email)
+        )
+    )
+
+    contact_list = ContactList(name=name)
+    db.session.add(contact_list)
+    db.session.flush()
+
+    db.session.execute(
+        list_members.insert().from_select(
+            ['list_id', 'contact_id'],
+            select(literal(contact_list.id), Contact.id)
+            .join(Recipient, Contact.email == email)
+            .where(Recipient.campaign_id == campaign.id)
+            .distinct()
+        )
+    )
+
+    # Los recipients de la campaña quedan enlazados a sus contactos
+    db.session.execute(
+        db.update(Recipient)
+        .where(Recipient.campaign_id == campaign.id)
+        .values(contact_id=select(Contact.id).where(Contact.email == email).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    campaign.list_id = contact_list.id
+    return contact_list
+
+
+def target_list(campaign, contact_list):
+    """Crea los recipients de la campaña a partir de la lista con un solo INSERT ... SELECT"""
+    result = db.session.execute(
+        db.insert(Recipient).from_select(
+            ['id', 'campaign_id', 'contact_id', 'email', 'name', 'domain', 'sent', 'tracking_token'],
+            select(
+                random_id(), literal(campaign.id), Contact.id, Contact.email, Contact.name,
+                Contact.domain, false(), random_id()
+            )
+            .join(list_members, list_members.c.contact_id == Contact.id)
+            .where(list_members.c.list_id == contact_list.id)
+        )
+    )
+    campaign.list_id = contact_list.id
+    return result.rowcount
+
+
+def clone_campaign(campaign, name=None):
+    """
+    Nueva campaña en borrador con el mismo contenido y los mismos destinatarios, sin su
+    estado de envío. Si la original usaba una lista, la copia la usa también.
+    """
+    clone = Campaign(
+        name=name or f'{campaign.name} (copia)',
+        subject=campaign.subject,
+        html_content=campaign.html_content,
+        prepared_html=campaign.prepared_html,
+        html_size_original=campaign.html_size_original,
+        html_size_optimized=campaign.html_size_optimized,
+        sender_email=campaign.sender_email,
+        sender_name=campaign.sender_name
+    )
+    # El HTML preparado enlaza a /c/<token>/<link_id>: la tabla de enlaces se copia igual
+    clone.links = [CampaignLink(link_id=link.link_id, url=link.url) for link in campaign.links]
+    db.session.add(clone)
+    db.session.flush()
+
+    contact_list = db.session.get(ContactList, campaign.list_id) if campaign.list_id else None
+    if contact_list is not None:
+        target_list(clone, contact_list)
+        return clone
+
+    db.session.execute(
+        db.insert(Recipient).from_select(
+            ['id', 'campaign_id', 'contact_id', 'email', 'name', 'domain', 'sent', 'tracking_token'],
+            select(
+                random_id(), literal(clone.id), Recipient.contact_id, Recipient.email, Recipient.name,
+                Recipient.domain, false(), random_id()
+            ).where(Recipient.campaign_id == campaign.id)
+        )
+    )
+    return clone
+
+
+def delete_list(contact_list):
+    """Borra la lista y sus miembros; los contactos y las campañas que la usaron se conservan"""
+    db.session.execute(list_members.delete().where(list_members.c.list_id == contact_list.id))
+    Campaign.query.filter_by(list_id=contact_list.id).update({'list_id': None}, synchronize_session=False)
+    db.session.delete(contact_list)
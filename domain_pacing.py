@@ -0,0 +1,266 @@
+"""
+Ritmo de envío por dominio del destinatario.
+
+Los proveedores grandes (gmail.com, hotmail.com, yahoo.com...) difieren mensajes cuando
+reciben muchos seguidos desde el mismo origen. El `DomainPacer` agrupa por dominio una
+ventana acotada de pendientes (usando la columna `recipients.domain`, calculada al
+importar), leída por páginas a medida que se envía, y los intercala en round-robin, aplicando a cada dominio un límite de concurrencia y un
+rate que se ajusta con las respuestas: cada diferimiento (4xx) lo reduce a la mitad y
+pausa el dominio; cada envío correcto lo sube poco a poco (AIMD).
+"""
+
+from config import Config
+from collections import deque
+import itertools
+import re
+import threading
+import time
+
+
+# Respuestas SMTP transitorias (4xx): el servidor pide reintentar más tarde
+DEFERRAL_PATTERN = re.compile(r'\(4\d\d,|\b4[25]\d[ -]|try again later|throttl|deferred', re.IGNORECASE)
+
+
+def email_domain(email):
+    """Dominio normalizado de un email (la parte después de la última @)"""
+    if not email or '@' not in email:
+        return None
+    return email.rsplit('@', 1)[1].strip().lower() or None
+
+
+def is_deferral(error):
+    """True si el error de envío es un diferimiento temporal del servidor receptor"""
+    return bool(error) and DEFERRAL_PATTERN.search(str(error)) is not None
+
+
+class DomainState:
+    """
+    Límites aprendidos para un dominio (compartidos por todas las campañas del proceso).
+    Se modifica solo con `_domain_states_lock` tomado: varios hilos envían a la vez.
+    """
+
+    def __init__(self):
+        self.rate = Config.DOMAIN_INITIAL_RATE          # Mensajes por segundo permitidos
+        self.max_in_flight = Config.DOMAIN_MAX_CONCURRENCY
+        self.leases = {}                                # Huecos ocupados: lease -> caducidad
+        self.next_allowed = 0.0                         # time.monotonic() del próximo envío
+        self.deferrals = 0
+
+    @property
+    def in_flight(self):
+        return len(self.leases)
+
+    def expire(self, now):
+        """Recupera los huecos de envíos que nunca reportaron su resultado"""
+        for lease, expires_at in list(self.leases.items()):
+            if expires_at <= now:
+                del self.leases[lease]
+
+    def ready(self, now):
+        return len(self.leases) < self.max_in_flight and now >= self.next_allowed
+
+    def wait(self, now):
+        """Segundos hasta que el dominio pueda volver a enviar"""
+        if len(self.leases) >= self.max_in_flight:
+            return min(self.leases.values()) - now
+        return self.next_allowed - now
+
+    def acquire(self, now):
+        lease = next(_leases)
+        self.leases[lease] = now + Config.DOMAIN_SLOT_TIMEOUT
+        self.next_allowed = now + 1.0 / self.rate
+        return lease
+
+    def on_success(self):
+        self.rate = min(Config.DOMAIN_MAX_RATE, self.rate + Config.DOMAIN_RATE_STEP)
+
+    def on_deferral(self, now):
+        self.deferrals += 1
+        self.rate = max(Config.DOMAIN_MIN_RATE, self.rate / 2)
+        self.next_allowed = max(self.next_allowed, now + Config.DOMAIN_DEFERRAL_BACKOFF)
+
+
+_domain_states = {}
+_domain_states_lock = threading.Lock()
+_leases = itertools.count()
+
+
+def _state(domain):
+    """Estado del dominio; requiere `_domain_states_lock` tomado"""
+    state = _domain_states.get(domain)
+    if state is None:
+        state = _domain_states[domain] = DomainState()
+    return state
+
+
+def get_domain_state(domain):
+    with _domain_states_lock:
+        return _state(domain)
+
+
+def keyset_pages(query, key):
+    """
+    Fuente de páginas para el DomainPacer: `fetch(after, limit)` lee las filas siguientes
+    de `query` ordenadas por `key` (paginación por clave, sin OFFSET ni reescaneos)
+    """
+    def fetch(after, limit):
+        page = query if after is None else query.filter(key > after)
+        return page.order_by(key).limit(limit).all()
+    return fetch
+
+
+class DomainPacer:
+    """
+    Cola de recipients intercalada por dominio.
+
+    Se construye con pares (recipient_id, dominio) o con una fuente paginada
+    (`keyset_pages`) y entrega ids con `next()`. Con fuente solo se mantiene en memoria
+    una ventana de `lookahead` pendientes, que se rellena a medida que se envía, así que la
+    memoria no depende del tamaño de la campaña. Quien envía debe reportar el resultado con
+    `success()`, `deferred()` o `failed()` para liberar el hueco de concurrencia del dominio
+    y ajustar su rate, o `release()` si no llega a enviarlo. Un hueco que nunca se libera
+    caduca a los DOMAIN_SLOT_TIMEOUT segundos.
+    """
+
+    MAX_DEFERRALS = 5   # Diferimientos por destinatario antes de marcarlo como error
+    MAX_WINDOW = 4      # Con todos los dominios en pausa, la ventana crece hasta N * lookahead
+
+    def __init__(self, rows=(), source=None, lookahead=None):
+        self._buckets = {}
+        self._order = deque()
+        self._deferrals = {}
+        self._domains = {}
+        self._size = 0
+        self._source = source
+        self._cursor = None
+        self._exhausted = source is None
+        self.lookahead = lookahead or Config.SEND_LOOKAHEAD
+        self.extend(rows)
+        self._fetch(self.lookahead)
+
+    def extend(self, rows):
+        """Agrega pares (recipient_id, dominio) al final de su cubeta"""
+        for recipient_id, domain in rows:
+            domain = domain or ''
+            bucket = self._buckets.get(domain)
+            if bucket is None:
+                bucket = self._buckets[domain] = deque()
+                self._order.append(domain)
+            bucket.append(recipient_id)
+            self._size += 1
+
+    def _fetch(self, limit):
+        """Lee la siguiente página de la fuente si la ventana tiene menos de `limit` ids"""
+        if self._exhausted or self._size >= limit:
+            return False
+        rows = self._source(self._cursor, self.lookahead)
+        if len(rows) < self.lookahead:
+            self._exhausted = True
+        if not rows:
+            return False
+        self._cursor = rows[-1][0]
+        self.extend(rows)
+        return True
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return bool(self._order) or not self._exhausted
+
+    def next(self):
+        """
+        Retorna (recipient_id, None) con el siguiente envío permitido, (None, segundos)
+        si todos los dominios están en espera, o (None, None) si no queda nada.
+        """
+        if self._size <= self.lookahead // 2:
+            self._fetch(self.lookahead)
+
+        recipient_id, wait = self._pick()
+        # Todos los dominios de la ventana en pausa: leer más por si aparecen otros dominios
+        while recipient_id is None and wait is not None and self._fetch(self.lookahead * self.MAX_WINDOW):
+            recipient_id, wait = self._pick()
+        return recipient_id, wait
+
+    def _pick(self):
+        if not self._order:
+            return None, None
+
+        now = time.monotonic()
+        wait = None
+
+        for _ in range(len(self._order)):
+            domain = self._order[0]
+            self._order.rotate(-1)
+
+            with _domain_states_lock:
+                state = _state(domain)
+                state.expire(now)
+                if not state.ready(now):
+                    delay = state.wait(now)
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                lease = state.acquire(now)
+
+            bucket = self._buckets[domain]
+            recipient_id = bucket.popleft()
+            self._size -= 1
+            if not bucket:
+                del self._buckets[domain]
+                self._order.remove(domain)
+
+            self._domains[recipient_id] = (domain, lease)
+            return recipient_id, None
+
+        return None, max(wait if wait is not None else 0.05, 0.01)
+
+    def _release(self, recipient_id, outcome=None):
+        """Libera el hueco del dominio y aplica el resultado. Retorna el dominio o None"""
+        held = self._domains.pop(recipient_id, None)
+        if held is None:
+            return None
+        domain, lease = held
+        with _domain_states_lock:
+            state = _state(domain)
+            state.leases.pop(lease, None)  # Ya no está si caducó
+            if outcome == 'success':
+                state.on_success()
+            elif outcome == 'deferred':
+                state.on_deferral(time.monotonic())
+        return domain
+
+    def release(self, recipient_id):
+        """
+        Libera el hueco de un recipient entregado por `next()` que no llegó a reportar
+        resultado (campaña detenida, excepción). No hace nada si ya se reportó.
+        """
+        self._release(recipient_id)
+
+    def close(self):
+        """Libera los huecos de todos los recipients en vuelo (al descartar el pacer)"""
+        for recipient_id in list(self._domains):
+            self._release(recipient_id)
+
+    def success(self, recipient_id):
+        self._release(recipient_id, 'success')
+        self._deferrals.pop(recipient_id, None)
+
+    def failed(self, recipient_id):
+        self._release(recipient_id)
+        self._deferrals.pop(recipient_id, None)
+
+    def deferred(self, recipient_id):
+        """
+        Registra un diferimiento y vuelve a encolar el recipient al final de su dominio.
+        Retorna False si ya agotó sus reintentos (el llamador debe marcarlo como error).
+        """
+        domain = self._release(recipient_id, 'deferred')
+
+        count = self._deferrals.get(recipient_id, 0) + 1
+        if count >= self.MAX_DEFERRALS:
+            self._deferrals.pop(recipient_id, None)
+            return False
+
+        self._deferrals[recipient_id] = count
+        self.extend([(recipient_id, domain or '')])
+        return True
@@ -0,0 +1,180 @@
+"""
+Validación de emails al importar destinatarios.
+
+1. Sintaxis: un regex precompilado (subconjunto práctico de RFC 5321/5322) con límites
+   de longitud.
+2. Errores tipográficos en el dominio (gmial.com, hotmial.com, gmail.con...): tabla de
+   correcciones; la dirección se rechaza y se informa la sugerencia.
+3. Existencia de MX (opcional, EMAIL_MX_CHECK): una consulta DNS por dominio distinto,
+   resueltas en paralelo y guardadas en `domain_mx_cache` con TTL, así que una lista de
+   un millón de filas cuesta tantas consultas como dominios nuevos tenga. El resolver se
+   puede inyectar para trabajar sin red.
+"""
+
+from models import db, DomainMXCache
+from config import Config
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import sqlite, postgresql
+import re
+import socket
+
+try:
+    import dns.resolver
+    import dns.exception
+except ImportError:  # dnspython es opcional: sin él solo se comprueba que el dominio resuelva
+    dns = None
+
+
+EMAIL_PATTERN = re.compile(
+    r"^(?!\.)(?!.*\.\.)[A-Za-z0-9!#$%&'*+/=?^_`{|}~.-]+(?<!\.)"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+"
+    r"(?:[A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})$"
+)
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+
+# Dominios mal escritos frecuentes -> dominio correcto
+DOMAIN_TYPOS = {
+    'gmial.com': 'gmail.com', 'gmai.com': 'gmail.com', 'gamil.com': 'gmail.com',
+    'gnail.com': 'gmail.com', 'gmaill.com': 'gmail.com', 'gmail.co': 'gmail.com',
+    'gmail.con': 'gmail.com', 'gmail.cm': 'gmail.com', 'gmail.om': 'gmail.com',
+    'gmail.cmo': 'gmail.com', 'gmail.comm': 'gmail.com', 'gmal.com': 'gmail.com',
+    'gmil.com': 'gmail.com', 'gmali.com': 'gmail.com', 'gmsil.com': 'gmail.com',
+    'hotmial.com': 'hotmail.com', 'hotmal.com': 'hotmail.com', 'hotmil.com': 'hotmail.com',
+    'hotmai.com': 'hotmail.com', 'hotmaill.com': 'hotmail.com', 'hotamil.com': 'hotmail.com',
+    'homail.com': 'hotmail.com', 'hotmail.co': 'hotmail.com', 'hotmail.con': 'hotmail.com',
+    'hotmail.cm': 'hotmail.com', 'hotmail.comm': 'hotmail.com', 'hotmail.es.com': 'hotmail.es',
+    'yahooo.com': 'yahoo.com', 'yaho.com': 'yahoo.com', 'yhoo.com': 'yahoo.com',
+    'yahoo.con': 'yahoo.com', 'yahoo.cm': 'yahoo.com', 'yahho.com': 'yahoo.com',
+    'outlok.com': 'outlook.com', 'outllok.com': 'outlook.com', 'outlook.co': 'outlook.com',
+    'outlook.con': 'outlook.com', 'otlook.com': 'outlook.com', 'outloo.com': 'outlook.com',
+    'iclod.com': 'icloud.com', 'icoud.com': 'icloud.com', 'icloud.co': 'icloud.com',
+    'icloud.con': 'icloud.com', 'live.con': 'live.com', 'msn.con': 'msn.com',
+}
+
+
+def validate_email(email):
+    """
+    Valida sintaxis y dominio. Retorna (válido, motivo, sugerencia): el motivo es
+    'syntax' o 'typo', y la sugerencia el email corregido cuando el dominio es un error
+    tipográfico conocido.
+    """
+    if not email or len(email) > MAX_EMAIL_LENGTH or not EMAIL_PATTERN.match(email):
+        return False, 'syntax', None
+
+    local, domain = email.rsplit('@', 1)
+    if len(local) > MAX_LOCAL_LENGTH:
+        return False, 'syntax', None
+
+    correction = DOMAIN_TYPOS.get(domain.lower())
+    if correction:
+        return False, 'typo', f'{local}@{correction}'
+
+    return True, None, None
+
+
+# ============ COMPROBACIÓN DE MX ============
+
+def resolve_mx(domain, timeout=None):
+    """
+    True si el dominio acepta correo (MX, o A/AAAA como respaldo según RFC 5321), False si
+    no existe o publica un MX nulo (RFC 7505), None si la consulta falla.
+    """
+    timeout = timeout or Config.MX_CHECK_TIMEOUT
+
+    if dns is not None:
+        try:
+            answers = dns.resolver.resolve(domain, 'MX', lifetime=timeout)
+            # MX nulo: "0 ." indica que el dominio no recibe correo
+            return not all(str(record.exchange) == '.' for record in answers)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            pass  # Sin MX: se comprueba si tiene dirección
+        except dns.exception.DNSException:
+            return None
+
+    try:
+        socket.getaddrinfo(domain, None)
+        return True
+    except socket.gaierror as e:
+        if e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+            return False
+        return None
+    except OSError:
+        return None
+
+
+def _store(rows):
+    """Guarda los resultados en la cache (varias importaciones pueden resolver el mismo dominio)"""
+    table = DomainMXCache.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['domain'],
+            set_={column: stmt.excluded[column] for column in ('accepts_mail', 'checked_at', 'expires_at')}
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        db.session.merge(DomainMXCache(**row))
+
+
+class MXChecker:
+    """Comprueba dominios con la cache persistente y resuelve en paralelo los que faltan"""
+
+    PROGRESS_ROUNDS = 4   # Rondas de consultas paralelas entre dos llamadas a on_progress
+
+    def __init__(self, resolver=None, workers=None):
+        self.resolver = resolver or resolve_mx
+        self.workers = workers or Config.MX_CHECK_WORKERS
+
+    def check(self, domains, on_progress=None):
+        """
+        Retorna {dominio: True/False/None} para los dominios dados (una consulta por dominio).
+        on_progress se llama entre grupos de consultas, antes de escribir en la sesión.
+        """
+        domains = {domain.lower() for domain in domains if domain}
+        if not domains:
+            return {}
+
+        now = datetime.utcnow()
+        results = {}
+        # Sin autoflush: no abrir una transacción de escritura mientras se espera al DNS
+        with db.session.no_autoflush:
+            for entry in DomainMXCache.query.filter(DomainMXCache.domain.in_(domains)):
+                if entry.expires_at > now:
+                    results[entry.domain] = entry.accepts_mail
+
+        missing = sorted(domains - results.keys())
+        if missing:
+            resolved = {}
+            group_size = self.workers * self.PROGRESS_ROUNDS
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                for start in range(0, len(missing), group_size):
+                    group = missing[start:start + group_size]
+                    resolved.update(zip(group, executor.map(self.resolver, group)))
+                    if on_progress:
+                        on_progress()
+
+            rows = []
+            for domain, accepts_mail in resolved.items():
+                results[domain] = accepts_mail
+                if accepts_mail is None:
+                    continue  # Error de DNS: no se cachea, se reintentará en otra importación
+                ttl = Config.MX_CACHE_TTL_HOURS if accepts_mail else Config.MX_NEGATIVE_TTL_HOURS
+                rows.append({
+                    'domain': domain,
+                    'accepts_mail': accepts_mail,
+                    'checked_at': now,
+                    'expires_at': now + timedelta(hours=ttl)
+                })
+            if rows:
+                _store(rows)
+
+        return results
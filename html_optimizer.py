@@ -0,0 +1,287 @@
+"""
+Preprocesado del HTML de una campaña: se ejecuta una sola vez al crearla.
+
+- Inlining de CSS: las reglas simples de los bloques <style> (tag, .clase, #id y sus
+  combinaciones) se copian al atributo style de cada elemento, que es lo único que
+  respetan muchos clientes de correo. Lo que no se puede inlinear (at-rules, selectores
+  descendientes, pseudo-clases, !important...) se conserva en <style>, y una propiedad
+  que también fija alguna de esas reglas no se inlinea en ningún elemento: el style en
+  línea le ganaría y cambiaría la cascada. Lo que se conserva (las reglas `@media` para
+  móvil incluidas) queda en un único <style> en <head>, el único que respeta Gmail; los
+  bloques <style media="..."> no se tocan.
+- Minificación: elimina comentarios (salvo los condicionales de Outlook) y colapsa
+  espacios, sin tocar <pre>, <textarea> ni <script>.
+- Informe de tamaño antes/después con aviso del recorte de Gmail (102 KB).
+"""
+
+import re
+
+
+GMAIL_CLIP_BYTES = 102 * 1024
+
+STYLE_BLOCK = re.compile(r'<style\b([^>]*)>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+MEDIA_ATTR = re.compile(r'\smedia\s*=', re.IGNORECASE)
+HEAD_END = re.compile(r'</head\s*>', re.IGNORECASE)
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*|\*)?((?:[.#][-\w]+)*)$')
+# Los valores entre comillas pueden contener '>' (title="a > b")
+OPEN_TAG = re.compile(
+    r'<([a-zA-Z][a-zA-Z0-9]*)'
+    r'((?:\s+[^\s=>/"\']+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s>"\']+))?)*)\s*(/?)>'
+)
+ATTRIBUTE = re.compile(r'\s+([^\s=>/"\']+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>"\']+))?')
+DECLARATION_SPLIT = re.compile(r';(?![^(]*\))')
+# Declaraciones dentro de un bloque de CSS (para saber qué propiedades fija)
+DECLARATION = re.compile(r'([-\w]+)\s*:([^;{}]*)(?=[;}])')
+IMPORTANT = re.compile(r'!\s*important\s*$', re.IGNORECASE)
+
+# Elementos a los que nunca se les agrega style
+NON_VISUAL_TAGS = {'html', 'head', 'meta', 'title', 'style', 'script', 'link', 'base'}
+
+HTML_COMMENT = re.compile(r'<!--(?!\[if)(?!<!)(?!\s*\[endif\]).*?-->', re.DOTALL)
+PRESERVED_BLOCK = re.compile(r'<(pre|textarea|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+WHITESPACE = re.compile(r'\s+')
+BLOCK_TAGS = (
+    r'html|head|body|meta|title|style|link|table|thead|tbody|tfoot|tr|td|th|div|p|'
+    r'h[1-6]|ul|ol|li|center|br|hr|section|header|footer'
+)
+BETWEEN_BLOCKS = re.compile(r'(<(?:/?(?:' + BLOCK_TAGS + r'))\b[^>]*>)\s+(?=<(?:/?(?:' + BLOCK_TAGS + r'))\b)', re.IGNORECASE)
+
+
+def byte_size(html):
+    return len(html.encode('utf-8')) if html else 0
+
+
+# ============ INLINING DE CSS ============
+
+def _parse_declarations(text):
+    declarations = []
+    for part in DECLARATION_SPLIT.split(text):
+        if ':' not in part:
+            continue
+        prop, value = part.split(':', 1)
+        prop, value = prop.strip().lower(), value.strip()
+        if prop and value:
+            declarations.append((prop, value))
+    return declarations
+
+
+def _split_rules(css):
+    """Pares (prelude, cuerpo) de un bloque de CSS, en orden"""
+    css = CSS_COMMENT.sub('', css)
+    pos = 0
+
+    while pos < len(css):
+        brace = css.find('{', pos)
+        if brace == -1:
+            break
+        prelude = css[pos:brace].strip()
+
+        # Encontrar la llave de cierre (las at-rules pueden tener bloques anidados)
+        depth, end = 0, brace
+        while end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        yield prelude, css[brace + 1:end].strip()
+        pos = end + 1
+
+
+def _overridable_properties(css):
+    """
+    Propiedades que fija un CSS que se queda en <style>. Las !important no cuentan: ganan
+    igualmente al style en línea.
+    """
+    return {
+        prop.lower() for prop, value in DECLARATION.findall(CSS_COMMENT.sub('', css))
+        if not IMPORTANT.search(value.strip())
+    }
+
+
+def _parse_css(blocks, kept_css=''):
+    """
+    Separa las reglas inlineables del CSS que debe quedarse en <style>. Retorna las reglas
+    (ordenadas por especificidad y orden) y el CSS residual de cada bloque.
+    """
+    parsed = []
+    blocked = _overridable_properties(kept_css)
+    for css in blocks:
+        block = []
+        for prelude, body in _split_rules(css):
+            selectors = [] if prelude.startswith('@') else [s.strip() for s in prelude.split(',') if s.strip()]
+            block.append((prelude, body, selectors))
+            complex_selectors = [s for s in selectors if not SIMPLE_SELECTOR.match(s)]
+            if prelude.startswith('@') or complex_selectors:
+                blocked |= _overridable_properties(f'{{{body}}}')
+        parsed.append(block)
+
+    rules = []
+    residual = []
+    for block in parsed:
+        kept = []
+        for prelude, body, selectors in block:
+            if prelude.startswith('@'):
+                kept.append(f'{prelude}{{{body}}}')
+                continue
+
+            declarations = _parse_declarations(body)
+            for selector in selectors:
+                match = SIMPLE_SELECTOR.match(selector)
+                if not match:
+                    kept.append(f'{selector}{{{body}}}')
+                    continue
+
+                # !important y propiedades que otra regla del <style> también fija: se quedan
+                inline = [
+                    (prop, value) for prop, value in declarations
+                    if prop not in blocked and not IMPORTANT.search(value)
+                ]
+                stay = [declaration for declaration in declarations if declaration not in inline]
+                if stay:
+                    kept.append(f'{selector}{{' + ';'.join(f'{prop}:{value}' for prop, value in stay) + '}')
+                if not inline:
+                    continue
+
+                tag = (match.group(1) or '').lower()
+                parts = re.findall(r'([.#])([-\w]+)', match.group(2))
+                ids = {name for kind, name in parts if kind == '#'}
+                classes = {name for kind, name in parts if kind == '.'}
+                specificity = (len(ids), len(classes), 1 if tag and tag != '*' else 0)
+                rules.append((specificity, len(rules), tag, ids, classes, inline))
+        residual.append(kept)
+
+    rules.sort(key=lambda rule: (rule[0], rule[1]))
+    return rules, residual
+
+
+def _attribute_value(value):
+    if value and value[0] in '"\'':
+        return value[1:-1]
+    return value or ''
+
+
+def _inline_tag(match, rules):
+    tag, attrs, self_closing = match.group(1), match.group(2) or '', match.group(3)
+    if tag.lower() in NON_VISUAL_TAGS:
+        return match.group(0)
+
+    attributes = {}
+    for attribute in ATTRIBUTE.finditer(attrs):
+        attributes.setdefault(attribute.group(1).lower(), attribute)
+    class_attr, id_attr = attributes.get('class'), attributes.get('id')
+    classes = set(_attribute_value(class_attr.group(2)).split()) if class_attr else set()
+    element_id = _attribute_value(id_attr.group(2)).strip() if id_attr else None
+
+    merged = {}
+    for _, _, rule_tag, ids, rule_classes, declarations in rules:
+        if rule_tag and rule_tag != '*' and rule_tag != tag.lower():
+            continue
+        if ids and ids != {element_id}:
+            continue
+        if not rule_classes <= classes:
+            continue
+        for prop, value in declarations:
+            merged.pop(prop, None)
+            merged[prop] = value
+
+    if not merged:
+        return match.group(0)
+
+    # El style propio del elemento tiene prioridad sobre las reglas del <style>
+    style_attr = attributes.get('style')
+    if style_attr:
+        for prop, value in _parse_declarations(_attribute_value(style_attr.group(2))):
+            merged.pop(prop, None)
+            merged[prop] = value
+        attrs = attrs[:style_attr.start()] + attrs[style_attr.end():]
+
+    style = '; '.join(f'{prop}: {value}' for prop, value in merged.items()).replace('"', "'")
+    return f'<{tag}{attrs} style="{style}"{self_closing}>'
+
+
+def _inlineable_block(match):
+    """Los <style> para medios concretos (<style media="print">) se dejan intactos"""
+    return not MEDIA_ATTR.search(match.group(1))
+
+
+def inline_css(html):
+    """Copia las reglas simples de los <style> a los atributos style de los elementos"""
+    blocks = list(STYLE_BLOCK.finditer(html))
+    inlineable = [match for match in blocks if _inlineable_block(match)]
+    if not inlineable:
+        return html
+
+    kept_css = '\n'.join(match.group(2) for match in blocks if not _inlineable_block(match))
+    rules, residual = _parse_css([match.group(2) for match in inlineable], kept_css)
+    if not rules:
+        return html
+
+    # Lo que no se pudo inlinear (@media, selectores complejos...) se junta en un solo
+    # <style>, en el sitio del primer bloque hasta saber si hay <head>
+    kept = [rule for block in residual for rule in block]
+
+    def replace_block(match):
+        if not _inlineable_block(match):
+            return match.group(0)
+        return '\x00' if match.start() == inlineable[0].start() else ''
+
+    html = STYLE_BLOCK.sub(replace_block, html)
+    html = OPEN_TAG.sub(lambda match: _inline_tag(match, rules), html)
+
+    style = '<style type="text/css">' + '\n'.join(kept) + '</style>' if kept else ''
+    head_end = HEAD_END.search(html)
+    if style and head_end and head_end.start() < html.index('\x00'):
+        html = html[:head_end.start()] + style + html[head_end.start():]
+        style = ''
+    return html.replace('\x00', style, 1)
+
+
+# ============ MINIFICACIÓN ============
+
+def minify_html(html):
+    """Elimina comentarios y espacios sobrantes sin alterar el texto visible"""
+    preserved = []
+
+    def protect(match):
+        preserved.append(match.group(0))
+        return f'\x00{len(preserved) - 1}\x00'
+
+    html = PRESERVED_BLOCK.sub(protect, html)
+    html = HTML_COMMENT.sub('', html)
+    html = WHITESPACE.sub(' ', html)
+    html = BETWEEN_BLOCKS.sub(r'\1', html)
+    html = re.sub(r'\x00(\d+)\x00', lambda match: preserved[int(match.group(1))], html)
+    return html.strip()
+
+
+def optimize_html(html):
+    """Inlining + minificación. Retorna (html_optimizado, informe de tamaños)"""
+    optimized = minify_html(inline_css(html))
+    return optimized, size_report(html, optimized)
+
+
+def size_report(original, optimized, sent=None):
+    """Informe de tamaños en bytes; `sent` es el HTML final con tracking, si se conoce"""
+    original_size = byte_size(original)
+    optimized_size = byte_size(optimized)
+    sent_size = byte_size(sent) if sent is not None else optimized_size
+
+    warnings = []
+    if sent_size > GMAIL_CLIP_BYTES:
+        warnings.append(
+            f'El HTML final pesa {sent_size / 1024:.1f} KB: Gmail recorta los mensajes de más de '
+            f'{GMAIL_CLIP_BYTES // 1024} KB y oculta el resto (incluido el pixel de apertura).'
+        )
+
+    return {
+        'original_size': original_size,
+        'optimized_size': optimized_size,
+        'sent_size': sent_size,
+        'saved_percent': round((1 - optimized_size / original_size) * 100, 2) if original_size else 0,
+        'gmail_clipped': sent_size > GMAIL_CLIP_BYTES,
+        'warnings': warnings
+    }
@@ -0,0 +1,341 @@
+"""
+Importación de destinatarios en segundo plano.
+
+El CSV subido se guarda en uploads/ y un hilo lo procesa por bloques. Cada bloque se
+confirma junto con los contadores del job y la posición alcanzada (`committed_rows`),
+de modo que una importación interrumpida se reanuda desde el último bloque confirmado.
+Cualquier worker puede reanudar un job cuyo latido haya caducado.
+"""
+
+from models import db, Recipient, ImportJob
+from domain_pacing import email_domain
+from email_validation import validate_email, MXChecker
+from config import Config
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+import codecs
+import csv
+import json
+import os
+import socket
+import threading
+import time
+
+
+ENCODINGS = ['utf-8', 'utf-8-sig', 'latin-1', 'iso-8859-1', 'cp1252']
+EMAIL_COLUMNS = ['email', 'e-mail', 'correo', 'mail']
+NAME_COLUMNS = ['name', 'nombre', 'nombre completo', 'full name']
+MAX_REPORTED_ERRORS = 10
+MAX_REPORTED_SUGGESTIONS = 50
+
+
+def detect_encoding(path, block_size=1024 * 1024):
+    """Primer encoding de ENCODINGS capaz de decodificar el archivo completo"""
+    for encoding in ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def parse_recipient_row(row):
+    """Extrae (email, nombre) de una fila del CSV, tolerando variantes de encabezados"""
+    # Limpiar BOM de las claves del row también
+    cleaned_row = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        cleaned_key = key.strip().lstrip('\ufeff')
+        cleaned_row[cleaned_key] = value or ''
+
+    # Detectar columna de email (varios formatos posibles, case-insensitive)
+    email = None
+    for key in cleaned_row.keys():
+        if key and key.lower().strip() in EMAIL_COLUMNS:
+            email = cleaned_row.get(key, '').strip()
+            break
+
+    # Si no se encontró, intentar con los nombres exactos
+    if not email:
+        email = (
+            cleaned_row.get('email', '') or
+            cleaned_row.get('Email', '') or
+            cleaned_row.get('EMAIL', '') or
+            cleaned_row.get('e-mail', '') or
+            cleaned_row.get('E-mail', '') or
+            cleaned_row.get('Otro e-mail', '') or
+            cleaned_row.get('correo', '') or
+            cleaned_row.get('Correo', '') or
+            ''
+        ).strip()
+
+    # Detectar columna de nombre (varios formatos posibles, case-insensitive)
+    name = None
+    for key in cleaned_row.keys():
+        if key and key.lower().strip() in NAME_COLUMNS:
+            name = cleaned_row.get(key, '').strip()
+            break
+
+    # Si no se encontró, intentar con los nombres exactos
+    if not name:
+        name = (
+            cleaned_row.get('name', '') or
+            cleaned_row.get('Name', '') or
+            cleaned_row.get('NAME', '') or
+            cleaned_row.get('nombre', '') or
+            cleaned_row.get('Nombre', '') or
+            ''
+        ).strip()
+
+    return email, name or None
+
+
+class ImportJobRunner:
+    """Lanza, reanuda y procesa los jobs de importación de este proceso"""
+
+    CHUNK_SIZE = 1000             # Filas por bloque confirmado
+    STALE_SECONDS = 60            # Sin latido durante este tiempo = job interrumpido
+    RESUME_CHECK_SECONDS = 60     # Frecuencia de búsqueda de jobs interrumpidos
+
+    def __init__(self, app, mx_checker=None):
+        self.app = app
+        # Comprobación de MX por dominio (desactivada salvo EMAIL_MX_CHECK o checker inyectado)
+        self.mx_checker = mx_checker or (MXChecker() if Config.EMAIL_MX_CHECK else None)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._last_check = 0.0
+        self._check_lock = threading.Lock()
+
+    def start(self, job_id):
+        thread = threading.Thread(target=self._run, args=(job_id,))
+        thread.daemon = True
+        thread.start()
+
+    def maybe_resume(self):
+        """
+        Reanuda (como mucho una vez por minuto) los jobs cuyo worker dejó de latir y los que
+        siguen en cola tras STALE_SECONDS (el proceso murió antes de lanzar su hilo)
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.RESUME_CHECK_SECONDS:
+            return
+        with self._check_lock:
+            if now - self._last_check < self.RESUME_CHECK_SECONDS:
+                return
+            self._last_check = now
+
+        stale = datetime.utcnow() - timedelta(seconds=self.STALE_SECONDS)
+        job_ids = [
+            row.id for row in db.session.query(ImportJob.id).filter(or_(
+                and_(ImportJob.status == 'running', ImportJob.heartbeat_at < stale),
+                and_(ImportJob.status == 'queued', ImportJob.created_at < stale)
+            ))
+        ]
+        for job_id in job_ids:
+            self.start(job_id)
+
+    def _claim(self, job_id):
+        """Toma el job de forma atómica: solo un worker lo procesa a la vez"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.STALE_SECONDS)
+        claimed = ImportJob.query.filter(
+            ImportJob.id == job_id,
+            or_(
+                ImportJob.status == 'queued',
+                and_(ImportJob.status == 'running', ImportJob.heartbeat_at < stale)
+            )
+        ).update(
+            {'status': 'running', 'worker_id': self.worker_id, 'heartbeat_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                if self._claim(job_id):
+                    self._process(db.session.get(ImportJob, job_id))
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error en importación {job_id}: {e}")
+                job = db.session.get(ImportJob, job_id)
+                if job and job.status == 'running' and job.worker_id == self.worker_id:
+                    self._finish(job, 'failed', f'Error al procesar el archivo CSV: {e}')
+            finally:
+                db.session.remove()
+
+    def _owned(self, job_id):
+        """Filtro del job mientras siga en curso y lo tenga este worker"""
+        return ImportJob.query.filter_by(id=job_id, status='running', worker_id=self.worker_id)
+
+    def _still_running(self, job):
+        """
+        El job pudo cancelarse (o borrarse su campaña) desde la API, o tomarlo otro worker
+        si este dejó de latir más de STALE_SECONDS
+        """
+        return self._owned(job.id).with_entities(ImportJob.id).first() is not None
+
+    def _heartbeat(self, job_id):
+        """
+        Renueva el latido en su propia transacción: la del bloque tiene contadores a medias
+        que no deben confirmarse hasta insertar el bloque
+        """
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.status == 'running', ImportJob.worker_id == self.worker_id)
+                .values(heartbeat_at=datetime.utcnow())
+            )
+
+    def _process(self, job):
+        if not os.path.exists(job.file_path):
+            return self._finish(job, 'failed', 'El archivo subido ya no existe')
+
+        if not job.encoding:
+            job.encoding = detect_encoding(job.file_path)
+            if job.encoding is None:
+                return self._finish(job, 'failed', 'No se pudo decodificar el archivo CSV. Por favor usa UTF-8.')
+            db.session.commit()
+
+        # Emails ya presentes en la campaña (incluye bloques confirmados antes de una interrupción)
+        seen = {
+            email.lower() for (email,) in
+            db.session.query(Recipient.email).filter_by(campaign_id=job.campaign_id)
+        }
+        errors = json.loads(job.errors) if job.errors else []
+        suggestions = json.loads(job.suggestions) if job.suggestions else []
+        domains = {}  # dominio -> acepta correo (True/False/None), una consulta por dominio
+        batch = []
+        position = job.committed_rows
+
+        with open(job.file_path, encoding=job.encoding, newline='') as f:
+            reader = csv.DictReader(f)
+
+            # Verificar que el CSV tiene columnas
+            if not reader.fieldnames:
+                return self._finish(job, 'failed', 'El archivo CSV está vacío o no tiene encabezados')
+
+            if job.committed_rows == 0:
+                print(f"Columnas detectadas en CSV: {reader.fieldnames}")
+
+            for index, row in enumerate(reader):
+                # Filas ya confirmadas en una ejecución anterior
+                if index < job.committed_rows:
+                    continue
+
+                row_num = index + 2  # La línea 1 es el header
+                position = index + 1
+                job.rows_parsed += 1
+                try:
+                    email, name = parse_recipient_row(row)
+
+                    valid, reason, suggestion = validate_email(email)
+                    if not valid:
+                        job.skipped += 1
+                        if reason == 'typo':
+                            job.typos += 1
+                            if len(suggestions) < MAX_REPORTED_SUGGESTIONS:
+                                suggestions.append({'line': row_num, 'email': email, 'suggestion': suggestion})
+                    elif email.lower() in seen:
+                        job.duplicates += 1
+                    else:
+                        seen.add(email.lower())
+                        batch.append({
+                            'campaign_id': job.campaign_id,
+                            'email': email,
+                            'name': name,
+                            'domain': email_domain(email)
+                        })
+                        job.accepted += 1
+                except Exception as e:
+                    job.error_count += 1
+                    job.skipped += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append(f"Línea {row_num}: {str(e)}")
+
+                if position % self.CHUNK_SIZE == 0:
+                    batch = self._check_domains(job, batch, domains, errors)
+                    if not self._commit_chunk(job, batch, errors, suggestions, position):
+                        return
+                    batch = []
+
+            batch = self._check_domains(job, batch, domains, errors)
+            if not self._commit_chunk(job, batch, errors, suggestions, position):
+                return
+
+        print(f"CSV procesado: {job.accepted} agregados, {job.skipped} omitidos "
+              f"({job.typos} con errores tipográficos, {job.invalid_domains} sin MX), {job.duplicates} duplicados")
+        self._finish(job, 'done')
+
+    def _check_domains(self, job, batch, domains, errors):
+        """Descarta del bloque los emails cuyo dominio no recibe correo"""
+        if self.mx_checker is None or not batch:
+            return batch
+
+        new_domains = {row['domain'] for row in batch} - domains.keys()
+        if new_domains:
+            # Con muchos dominios nuevos las consultas DNS pueden durar más que STALE_SECONDS
+            job_id = job.id
+            domains.update(self.mx_checker.check(new_domains, on_progress=lambda: self._heartbeat(job_id)))
+
+        kept = []
+        for row in batch:
+            # None (error de DNS) no descarta: mejor intentar el envío que perder el contacto
+            if domains.get(row['domain']) is False:
+                job.accepted -= 1
+                job.skipped += 1
+                job.invalid_domains += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(f"{row['email']}: el dominio {row['domain']} no recibe correo")
+            else:
+                kept.append(row)
+        return kept
+
+    def _commit_chunk(self, job, batch, errors, suggestions, committed_rows):
+        """Inserta el bloque y guarda el progreso en la misma transacción"""
+        if not self._still_running(job):
+            return self._abandon(job)
+
+        if batch:
+            db.session.execute(db.insert(Recipient), batch)
+        job.committed_rows = committed_rows
+        job.errors = json.dumps(errors) if errors else None
+        job.suggestions = json.dumps(suggestions) if suggestions else None
+        # Condicionado al worker: otro pudo tomar el job después de _still_running
+        if self._owned(job.id).update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False) != 1:
+            return self._abandon(job)
+        db.session.commit()
+        return True
+
+    def _abandon(self, job):
+        """
+        Descarta el bloque en curso (se conservan los ya confirmados). Si el job se canceló
+        se borra el archivo; si lo tomó otro worker, ese worker sigue leyéndolo.
+        """
+        job_id, file_path = job.id, job.file_path
+        db.session.rollback()
+        status = db.session.query(ImportJob.status).filter_by(id=job_id).scalar()
+        if status != 'running':
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        return False
+
+    def _finish(self, job, status, error_message=None):
+        job.status = status
+        job.error_message = error_message
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+        if status in ('done', 'cancelled'):
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
@@ -0,0 +1,282 @@
+"""
+Primitivas de envío: construcción del mensaje, tracking y envío por SMTP con Amazon SES.
+Viven fuera de app.py para que el scheduler y otros procesos de envío puedan usarlas
+sin importar la aplicación Flask.
+"""
+
+from flask import current_app
+from config import Config
+from html_optimizer import optimize_html, size_report
+from smtp_pool import smtp_pool
+from analytics import analytics
+from profiling import stage
+from models import db, CampaignLink
+from collections import OrderedDict, namedtuple
+import html
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import re
+import threading
+import uuid
+from urllib.parse import quote
+
+
+# Marcador del token de tracking en el HTML preprocesado de la campaña
+TRACKING_TOKEN_PLACEHOLDER = '__TRACKING_TOKEN__'
+
+# Respuestas de rechazo de un mensaje concreto: no invalidan la conexión SMTP
+REUSABLE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+# Datos de la campaña que usa cada mensaje (ver message_template)
+CampaignMessage = namedtuple(
+    'CampaignMessage', ['id', 'subject', 'sender_email', 'sender_name', 'prepared_html', 'html_content']
+)
+
+# Cache en memoria de las tablas de enlaces: campaign_id -> {link_id: url}
+LINK_CACHE_SIZE = 256
+_link_cache = OrderedDict()
+_link_cache_lock = threading.Lock()
+
+
+def message_template(campaign):
+    """
+    Copia de lo que cada mensaje lee de la campaña, tomada una vez antes del bucle de envío.
+    El commit de cada destinatario expira la campaña: pasarle la campaña a send_email_smtp
+    releería su fila (con html_content) y prepared_html en cada mensaje.
+    """
+    return CampaignMessage(
+        id=campaign.id,
+        subject=campaign.subject,
+        sender_email=campaign.sender_email,
+        sender_name=campaign.sender_name,
+        prepared_html=campaign.prepared_html,
+        # Solo hace falta para campañas creadas antes del preprocesado
+        html_content=None if campaign.prepared_html else campaign.html_content
+    )
+
+
+def send_email_smtp(recipient, campaign, smtp_connection=None):
+    """
+    Envía un email usando Amazon SES SMTP (con una conexión del pool si no se pasa una).
+    `campaign` puede ser la campaña o su `message_template()`.
+    """
+    try:
+        # Obtener remitente de la campaña o usar el por defecto
+        sender_email = campaign.sender_email or Config.SENDER_EMAIL
+        sender_name = campaign.sender_name or Config.SENDER_NAME
+        
+        # HTML con pixel de tracking y links modificados
+        with stage('render'):
+            html_content = render_html(campaign, recipient.tracking_token)
+        
+        # Crear mensaje
+        with stage('encode'):
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = campaign.subject
+            msg['From'] = f"{sender_name} <{sender_email}>"
+            msg['To'] = recipient.email
+            msg.attach(MIMEText(html_content, 'html'))
+            message = msg.as_string()
+        
+        with stage('smtp'):
+            if smtp_connection:
+                smtp_connection.sendmail(sender_email, recipient.email, message)
+            else:
+                conn = smtp_pool.acquire()
+                try:
+                    conn.sendmail(sender_email, recipient.email, message)
+                except REUSABLE_ERRORS:
+                    # El servidor rechazó este mensaje, pero la conexión sigue sirviendo
+                    smtp_pool.release(conn)
+                    raise
+                except Exception:
+                    smtp_pool.release(conn, broken=True)
+                    raise
+                smtp_pool.release(conn)
+        
+        analytics.record(campaign.id, 'sends')
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+def add_tracking(html_content, tracking_token, links=None):
+    """
+    Agrega pixel de tracking para aperturas y modifica links para tracking de clics.
+    Con `links` (dict url -> link_id) los enlaces quedan como /c/<token>/<link_id> y el
+    dict se completa con las URLs nuevas; sin él se usa el formato antiguo ?url=.
+    """
+    base_url = Config.BASE_URL
+    
+    def tracking_url_for(url):
+        if links is None:
+            encoded_url = quote(url, safe='')
+            return f"{base_url}/track/click/{tracking_token}?url={encoded_url}"
+        link_id = links.setdefault(url, len(links) + 1)
+        return f"{base_url}/c/{tracking_token}/{link_id}"
+    
+    def is_excluded(url):
+        # Enlaces que ya son de tracking o enlaces javascript/mailto/data
+        return (
+            '/track/' in url or f'{base_url}/c/' in url or
+            url.startswith(('javascript:', 'mailto:', '#', 'data:', 'vbscript:'))
+        )
+    
+    # Agregar pixel de tracking antes del cierre de </body>
+    tracking_pixel = f'<img src="{base_url}/track/open/{tracking_token}" width="1" height="1" style="display:none;" />'
+    
+    if '</body>' in html_content.lower():
+        html_content = re.sub(
+            r'</body>',
+            f'{tracking_pixel}</body>',
+            html_content,
+            flags=re.IGNORECASE
+        )
+    else:
+        html_content += tracking_pixel
+    
+    # Debug: contar enlaces antes de modificar
+    links_before = len(re.findall(r'<a\s+[^>]*href\s*=\s*["\']?[^"\'>\s]+["\']?[^>]*>', html_content, re.IGNORECASE))
+    
+    # Modificar todos los enlaces <a href="..."> para que pasen por el tracking
+    def replace_link(match):
+        original_tag = match.group(0)
+        # El grupo 3 es el URL (después de href=" o href=')
+        url = match.group(3) if match.lastindex >= 3 else ''
+        
+        if not url:
+            return original_tag
+        
+        # Limpiar el URL de espacios
+        url = url.strip()
+        
+        # No modificar enlaces que ya sean de tracking o enlaces javascript/mailto/data
+        if is_excluded(url):
+            return original_tag
+        
+        # Crear URL de tracking
+        tracking_url = tracking_url_for(url)
+        
+        # Reemplazar el href en el tag (manejar comillas simples y dobles)
+        quote_char = match.group(2)  # La comilla usada (simple o doble)
+        return original_tag.replace(f'href={quote_char}{url}{quote_char}', f'href={quote_char}{tracking_url}{quote_char}')
+    
+    # Buscar y reemplazar todos los enlaces <a href="...">
+    # Patrón mejorado para capturar href con comillas simples o dobles, y manejar espacios
+    # Patrón: <a ... href=["'](url)["'] ...>
+    html_content = re.sub(
+        r'<a\s+([^>]*\s+)?href\s*=\s*(["\'])([^"\']+)\2([^>]*)>',
+        replace_link,
+        html_content,
+        flags=re.IGNORECASE
+    )
+    
+    # También buscar enlaces sin comillas (menos común pero posible)
+    def replace_link_no_quotes(match):
+        original_tag = match.group(0)
+        url = match.group(2) if match.lastindex >= 2 else ''
+        
+        if not url:
+            return original_tag
+        
+        url = url.strip()
+        
+        # Los href entre comillas ya los procesó el patrón anterior
+        if url.startswith(('"', "'")):
+            return original_tag
+        
+        # No modificar enlaces que ya sean de tracking o enlaces especiales
+        if is_excluded(url):
+            return original_tag
+        
+        # Crear URL de tracking
+        tracking_url = tracking_url_for(url)
+        
+        # Reemplazar el href
+        return original_tag.replace(f'href={url}', f'href="{tracking_url}"')
+    
+    # Buscar enlaces sin comillas (href=url sin comillas)
+    html_content = re.sub(
+        r'<a\s+([^>]*\s+)?href\s*=\s*([^\s>]+)([^>]*)>',
+        replace_link_no_quotes,
+        html_content,
+        flags=re.IGNORECASE
+    )
+    
+    # Debug: contar enlaces después de modificar
+    links_after = len(re.findall(r'/track/click/|/c/' + re.escape(str(tracking_token)) + '/', html_content))
+    
+    # Log para debugging (solo en desarrollo)
+    if current_app.debug:
+        print(f"Tracking: {links_before} enlaces encontrados, {links_after} enlaces modificados")
+    
+    return html_content
+
+
+def prepare_campaign_html(campaign):
+    """
+    Preprocesa el HTML de la campaña una sola vez: inlining de CSS, minificación y
+    tracking con el token como marcador. Retorna el informe de tamaños.
+    """
+    optimized, _ = optimize_html(campaign.html_content)
+    
+    # Tabla de enlaces de la campaña: cada destino distinto recibe un id corto
+    links = {}
+    campaign.prepared_html = add_tracking(optimized, TRACKING_TOKEN_PLACEHOLDER, links)
+    campaign.links = [
+        CampaignLink(link_id=link_id, url=html.unescape(url))
+        for url, link_id in links.items()
+    ]
+    
+    # Tamaño real de envío: con un token de verdad en lugar del marcador
+    sample = campaign.prepared_html.replace(TRACKING_TOKEN_PLACEHOLDER, str(uuid.uuid4()))
+    report = size_report(campaign.html_content, optimized, sample)
+    campaign.html_size_original = report['original_size']
+    campaign.html_size_optimized = report['sent_size']
+    return report
+
+
+def render_html(campaign, tracking_token):
+    """HTML final para un destinatario: solo sustituye el token en el HTML preprocesado"""
+    if campaign.prepared_html:
+        return campaign.prepared_html.replace(TRACKING_TOKEN_PLACEHOLDER, tracking_token)
+    # Campañas creadas antes del preprocesado
+    return add_tracking(campaign.html_content, tracking_token)
+
+
+def get_campaign_links(campaign_id):
+    """Tabla de enlaces de una campaña (inmutable tras crearla), cacheada por proceso"""
+    with _link_cache_lock:
+        links = _link_cache.get(campaign_id)
+        if links is not None:
+            _link_cache.move_to_end(campaign_id)
+            return links
+    
+    links = dict(
+        db.session.query(CampaignLink.link_id, CampaignLink.url).filter_by(campaign_id=campaign_id)
+    )
+    with _link_cache_lock:
+        _link_cache[campaign_id] = links
+        if len(_link_cache) > LINK_CACHE_SIZE:
+            _link_cache.popitem(last=False)
+    return links
+
+
+def resolve_link(campaign_id, link_id):
+    """URL de destino de un enlace corto, o None si no existe"""
+    return get_campaign_links(campaign_id).get(link_id)
+
+
+HREF_PATTERN = re.compile(r'<a\s+[^>]*?href\s*=\s*(["\']?)([^"\'>\s]+)\1', re.IGNORECASE)
+
+
+def is_known_link(campaign, url):
+    """True si la URL (ya sin escapes HTML) es uno de los enlaces del HTML de la campaña (para el formato ?url=)"""
+    known = set(get_campaign_links(campaign.id).values())
+    if url in known:
+        return True
+    for _, href in HREF_PATTERN.findall(campaign.html_content or ''):
+        if url == html.unescape(href.strip()):
+            return True
+    return False
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Script de migración para las listas de contactos.
+Crea las tablas contacts, contact_lists y list_members, y agrega campaigns.list_id y
+recipients.contact_id. Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+COLUMNS = [
+    ('campaigns', 'list_id', 'VARCHAR(36) REFERENCES contact_lists(id) ON DELETE SET NULL'),
+    ('recipients', 'contact_id', 'VARCHAR(36) REFERENCES contacts(id) ON DELETE SET NULL'),
+]
+
+def migrate():
+    """Crea las tablas nuevas y agrega las columnas que faltan"""
+    with app.app_context():
+        try:
+            # Tablas nuevas (las columnas nuevas hacen referencia a ellas)
+            db.create_all()
+            print("✓ Tablas contacts, contact_lists y list_members listas")
+            
+            inspector = db.inspect(db.engine)
+            for table, column, definition in COLUMNS:
+                columns = [col['name'] for col in inspector.get_columns(table)]
+                if column not in columns:
+                    print(f"Agregando columna {table}.{column}...")
+                    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                    db.session.commit()
+                    print(f"✓ Columna {table}.{column} agregada")
+                else:
+                    print(f"✓ Columna {table}.{column} ya existe")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Script de migración para la validación de emails al importar.
+Agrega los contadores de errores tipográficos y dominios sin MX a import_jobs y crea la
+tabla domain_mx_cache. Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+COLUMNS = {
+    'typos': 'INTEGER DEFAULT 0',
+    'invalid_domains': 'INTEGER DEFAULT 0',
+    'suggestions': 'TEXT',
+}
+
+def migrate():
+    """Agrega las columnas nuevas de import_jobs y crea domain_mx_cache"""
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            if 'import_jobs' in inspector.get_table_names():
+                columns = [col['name'] for col in inspector.get_columns('import_jobs')]
+                for column, definition in COLUMNS.items():
+                    if column not in columns:
+                        print(f"Agregando columna {column}...")
+                        db.session.execute(text(f"ALTER TABLE import_jobs ADD COLUMN {column} {definition}"))
+                        db.session.commit()
+                        print(f"✓ Columna {column} agregada")
+                    else:
+                        print(f"✓ Columna {column} ya existe")
+            
+            # Crea domain_mx_cache (y import_jobs si no existía)
+            db.create_all()
+            print("✓ Tabla domain_mx_cache lista")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
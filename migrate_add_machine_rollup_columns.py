@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Script de migración para agregar los contadores de visitas automáticas a engagement_rollups.
+Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+def migrate():
+    """Agrega las columnas machine_opens y machine_clicks"""
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            if 'engagement_rollups' not in inspector.get_table_names():
+                db.create_all()
+                print("✓ Tabla engagement_rollups creada")
+                print("\n✅ Migración completada exitosamente!")
+                return
+            
+            columns = [col['name'] for col in inspector.get_columns('engagement_rollups')]
+            for column in ('machine_opens', 'machine_clicks'):
+                if column not in columns:
+                    print(f"Agregando columna {column}...")
+                    db.session.execute(text(f"ALTER TABLE engagement_rollups ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+                    db.session.commit()
+                    print(f"✓ Columna {column} agregada")
+                else:
+                    print(f"✓ Columna {column} ya existe")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Script de migración para crear el índice de recipients.campaign_id.
+Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+def migrate():
+    """Crea el índice usado por los conteos y el borrado masivo de recipients por campaña"""
+    with app.app_context():
+        try:
+            print("Creando índice ix_recipients_campaign_id...")
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_recipients_campaign_id ON recipients (campaign_id)"))
+            db.session.commit()
+            print("✓ Índice ix_recipients_campaign_id creado")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Script de migración para agregar la columna domain a la tabla recipients.
+Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+def migrate():
+    """Agrega la columna domain, la rellena a partir del email y crea su índice"""
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('recipients')]
+            
+            if 'domain' not in columns:
+                print("Agregando columna domain...")
+                db.session.execute(text("ALTER TABLE recipients ADD COLUMN domain VARCHAR(255)"))
+                db.session.commit()
+                print("✓ Columna domain agregada")
+            else:
+                print("✓ Columna domain ya existe")
+            
+            print("Calculando dominios de los destinatarios existentes...")
+            result = db.session.execute(text(
+                "UPDATE recipients "
+                "SET domain = lower(trim(substr(email, instr(email, '@') + 1))) "
+                "WHERE domain IS NULL AND instr(email, '@') > 0"
+            ))
+            db.session.commit()
+            print(f"✓ {result.rowcount} destinatarios actualizados")
+            
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_recipients_domain ON recipients (domain)"))
+            db.session.commit()
+            print("✓ Índice ix_recipients_domain creado")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
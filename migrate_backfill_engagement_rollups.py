@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Script de migración para rellenar engagement_rollups con el histórico de los recipients.
+Ejecutar una sola vez después de actualizar el código (con la aplicación detenida).
+
+Del histórico solo se conoce la primera apertura y el último clic de cada destinatario,
+así que los totales de aperturas y clics se rellenan igual que los únicos.
+"""
+
+from app import app, db
+from models import Campaign, Recipient, EngagementRollup
+from analytics import bucket_start, upsert_rollups, GRANULARITIES
+from collections import Counter, defaultdict
+
+def migrate():
+    """Recalcula los rollups de cada campaña a partir de sent_at, opened_at y clicked_at"""
+    with app.app_context():
+        try:
+            db.create_all()
+            campaign_ids = [campaign_id for (campaign_id,) in db.session.query(Campaign.id)]
+            print(f"Rellenando rollups de {len(campaign_ids)} campañas...")
+
+            for campaign_id in campaign_ids:
+                pending = defaultdict(Counter)
+                for column, counters in [
+                    (Recipient.sent_at, ('sends',)),
+                    (Recipient.opened_at, ('opens', 'unique_opens')),
+                    (Recipient.clicked_at, ('clicks', 'unique_clicks'))
+                ]:
+                    # Solo se leen las fechas, por lotes, sin cargar los recipients
+                    rows = db.session.query(column).filter(
+                        Recipient.campaign_id == campaign_id, column != None
+                    ).yield_per(5000)
+                    for (at,) in rows:
+                        for granularity in GRANULARITIES:
+                            counts = pending[(campaign_id, granularity, bucket_start(at, granularity))]
+                            for counter in counters:
+                                counts[counter] += 1
+
+                # Reemplazar lo que hubiera: el script se puede ejecutar más de una vez
+                EngagementRollup.query.filter_by(campaign_id=campaign_id).delete(synchronize_session=False)
+                if pending:
+                    upsert_rollups(pending)
+                db.session.commit()
+                print(f"  ✓ {campaign_id}: {len(pending)} filas")
+
+            print("\n✅ Migración completada exitosamente!")
+
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Script de migración para agregar el HTML preprocesado a la tabla campaigns.
+Ejecutar una sola vez después de actualizar el código.
+"""
+
+from app import app, db
+from models import Campaign
+from mailer import prepare_campaign_html
+from sqlalchemy import text
+
+def migrate():
+    """Agrega las columnas del HTML preprocesado y lo calcula para las campañas existentes"""
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('campaigns')]
+            
+            for column, sql_type in [('prepared_html', 'TEXT'), ('html_size_original', 'INTEGER'), ('html_size_optimized', 'INTEGER')]:
+                if column not in columns:
+                    print(f"Agregando columna {column}...")
+                    db.session.execute(text(f"ALTER TABLE campaigns ADD COLUMN {column} {sql_type}"))
+                    db.session.commit()
+                    print(f"✓ Columna {column} agregada")
+                else:
+                    print(f"✓ Columna {column} ya existe")
+            
+            print("Preprocesando el HTML de las campañas existentes...")
+            # Solo las columnas que usa el preprocesado: las que agregan migraciones
+            # posteriores todavía no existen en una base de datos sin migrar
+            campaigns = Campaign.query.options(
+                db.load_only(Campaign.id, Campaign.name, Campaign.html_content)
+            ).filter(Campaign.prepared_html == None).all()
+            for campaign in campaigns:
+                report = prepare_campaign_html(campaign)
+                print(f"  {campaign.name}: {report['original_size']} → {report['sent_size']} bytes")
+            db.session.commit()
+            print(f"✓ {len(campaigns)} campañas preprocesadas")
+            
+            print("\n✅ Migración completada exitosamente!")
+            
+        except Exception as e:
+            print(f"❌ Error durante la migración: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    migrate()
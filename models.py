@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
+import json
 
 db = SQLAlchemy()
 
@@ -12,67 +13,110 @@ class Campaign(db.Model):
     name = db.Column(db.String(200), nullable=False)
     subject = db.Column(db.String(500), nullable=False)
     html_content = db.Column(db.Text, nullable=False)
+    # HTML optimizado y con tracking (token como marcador), calculado al crear la campaña
+    prepared_html = db.deferred(db.Column(db.Text, nullable=True))
+    html_size_original = db.Column(db.Integer, nullable=True)  # Bytes del HTML subido
+    html_size_optimized = db.Column(db.Integer, nullable=True)  # Bytes del HTML que se envía
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     sent_at = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='draft')  # draft, sending, sent, failed
     sender_email = db.Column(db.String(320), nullable=True)  # Email del remitente usado
     sender_name = db.Column(db.String(200), nullable=True)  # Nombre del remitente usado
+    list_id = db.Column(db.String(36), db.ForeignKey('contact_lists.id', ondelete='SET NULL'), nullable=True)  # Lista de origen
     
-    # Relationships
-    recipients = db.relationship('Recipient', backref='campaign', lazy=True, cascade='all, delete-orphan')
+    # Relationships (dynamic: nunca se cargan todos los recipients en memoria)
+    recipients = db.relationship('Recipient', backref='campaign', lazy='dynamic',
+                                 cascade='all, delete-orphan', passive_deletes=True)
     
     @property
     def total_sent(self):
-        return len([r for r in self.recipients if r.sent])
+        return self.recipients.filter(Recipient.sent == True).count()
     
     @property
     def total_opened(self):
-        return len([r for r in self.recipients if r.opened_at])
+        return self.recipients.filter(Recipient.opened_at != None).count()
     
     @property
     def total_clicked(self):
-        return len([r for r in self.recipients if r.clicked_at])
+        return self.recipients.filter(Recipient.clicked_at != None).count()
     
     @property
     def open_rate(self):
-        if self.total_sent == 0:
-            return 0
-        return round((self.total_opened / self.total_sent) * 100, 2)
+        return self.recipient_stats()['open_rate']
     
     @property
     def click_rate(self):
-        if self.total_sent == 0:
-            return 0
-        return round((self.total_clicked / self.total_sent) * 100, 2)
+        return self.recipient_stats()['click_rate']
     
-    def to_dict(self):
+    @staticmethod
+    def _stats_columns():
+        return (
+            db.func.count(Recipient.id),
+            db.func.count(db.case((Recipient.sent == True, 1))),
+            db.func.count(Recipient.opened_at),
+            db.func.count(Recipient.clicked_at),
+            db.func.count(Recipient.error_message)
+        )
+    
+    @staticmethod
+    def _stats_dict(total=0, sent=0, opened=0, clicked=0, failed=0):
+        return {
+            'total_recipients': total,
+            'total_sent': sent,
+            'total_opened': opened,
+            'total_clicked': clicked,
+            'total_failed': failed,
+            'open_rate': round((opened / sent) * 100, 2) if sent else 0,
+            'click_rate': round((clicked / sent) * 100, 2) if sent else 0
+        }
+    
+    def recipient_stats(self):
+        """Contadores de la campaña calculados con una sola consulta agregada"""
+        row = db.session.query(*self._stats_columns()).filter(Recipient.campaign_id == self.id).one()
+        return self._stats_dict(*row)
+    
+    @classmethod
+    def stats_by_campaign(cls):
+        """Contadores de todas las campañas con una sola consulta agrupada"""
+        rows = db.session.query(Recipient.campaign_id, *cls._stats_columns()).group_by(Recipient.campaign_id)
+        return {row[0]: cls._stats_dict(*row[1:]) for row in rows}
+    
+    def to_summary_dict(self, stats=None):
+        """Proyección para listados: sin html_content (se difiere en la consulta)"""
         return {
             'id': self.id,
             'name': self.name,
             'subject': self.subject,
-            'html_content': self.html_content,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'status': self.status,
             'sender_email': self.sender_email,
             'sender_name': self.sender_name,
-            'total_recipients': len(self.recipients),
-            'total_sent': self.total_sent,
-            'total_opened': self.total_opened,
-            'total_clicked': self.total_clicked,
-            'open_rate': self.open_rate,
-            'click_rate': self.click_rate
+            'list_id': self.list_id,
+            **(stats if stats is not None else self.recipient_stats())
         }
+    
+    def to_dict(self):
+        data = self.to_summary_dict()
+        data['html_content'] = self.html_content
+        data['html_size_original'] = self.html_size_original
+        data['html_size_optimized'] = self.html_size_optimized
+        data['schedule'] = self.schedule.to_dict() if self.schedule else None
+        return data
 
 
 class Recipient(db.Model):
     """Representa un destinatario de email"""
     __tablename__ = 'recipients'
+    # Paginación por id dentro de una campaña (envío por ventanas y shards)
+    __table_args__ = (db.Index('ix_recipients_campaign_id_id', 'campaign_id', 'id'),)
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id'), nullable=False)
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False, index=True)
+    contact_id = db.Column(db.String(36), db.ForeignKey('contacts.id', ondelete='SET NULL'), nullable=True)  # Si viene de una lista
     email = db.Column(db.String(320), nullable=False)
     name = db.Column(db.String(200), nullable=True)
+    domain = db.Column(db.String(255), nullable=True, index=True)  # Calculado al importar, para el ritmo por dominio
     sent = db.Column(db.Boolean, default=False)
     sent_at = db.Column(db.DateTime, nullable=True)
     opened_at = db.Column(db.DateTime, nullable=True)
@@ -95,17 +139,221 @@ class Recipient(db.Model):
         }
 
 
+# Contactos de cada lista (un contacto puede estar en varias listas)
+list_members = db.Table(
+    'list_members',
+    db.Column('list_id', db.String(36), db.ForeignKey('contact_lists.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('contact_id', db.String(36), db.ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+)
 
 
+class Contact(db.Model):
+    """Un email, una sola vez para todas las listas"""
+    __tablename__ = 'contacts'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    email = db.Column(db.String(320), nullable=False, unique=True)  # En minúsculas
+    name = db.Column(db.String(200), nullable=True)
+    domain = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class ContactList(db.Model):
+    """Lista reutilizable de contactos: las campañas la usan sin volver a subir el CSV"""
+    __tablename__ = 'contact_lists'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    contacts = db.relationship('Contact', secondary=list_members, lazy='dynamic')
+    
+    def to_dict(self, contact_count=None):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'contact_count': contact_count if contact_count is not None else self.contacts.count()
+        }
 
 
+class CampaignSchedule(db.Model):
+    """Programación y ritmo de envío de una campaña (persistido para sobrevivir reinicios)"""
+    __tablename__ = 'campaign_schedules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id'), nullable=False, unique=True)
+    start_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    window_minutes = db.Column(db.Integer, nullable=True)  # Ventana objetivo para completar el envío
+    hourly_cap = db.Column(db.Integer, nullable=True)  # Máximo de envíos por hora
+    weight = db.Column(db.Float, default=1.0)  # Peso en el reparto del rate global entre campañas
+    status = db.Column(db.String(20), default='pending')  # pending, active, paused, done
+    
+    # Estado del scheduler
+    total_planned = db.Column(db.Integer, default=0)  # Pendientes al activar la ventana
+    sent_count = db.Column(db.Integer, default=0)  # Intentos realizados dentro de la ventana
+    virtual_time = db.Column(db.Float, default=0.0)  # Tiempo virtual de la cola justa ponderada
+    hour_window_start = db.Column(db.DateTime, nullable=True)
+    hour_window_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    campaign = db.relationship('Campaign', backref=db.backref('schedule', uselist=False, cascade='all, delete-orphan'))
+    
+    @property
+    def end_at(self):
+        if not self.window_minutes:
+            return None
+        return self.start_at + timedelta(minutes=self.window_minutes)
+    
+    def to_dict(self):
+        return {
+            'campaign_id': self.campaign_id,
+            'start_at': self.start_at.isoformat() if self.start_at else None,
+            'end_at': self.end_at.isoformat() if self.end_at else None,
+            'window_minutes': self.window_minutes,
+            'hourly_cap': self.hourly_cap,
+            'weight': self.weight,
+            'status': self.status,
+            'total_planned': self.total_planned,
+            'sent_count': self.sent_count
+        }
+
+
+class SendShard(db.Model):
+    """
+    Rango de ids de recipients de una campaña que un nodo de envío toma en lease.
+    `lease_token` aumenta en cada asignación y sirve de fencing: un nodo solo confirma
+    envíos mientras su token siga siendo el vigente.
+    """
+    __tablename__ = 'send_shards'
+    __table_args__ = (db.UniqueConstraint('campaign_id', 'shard_index'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id'), nullable=False, index=True)
+    shard_index = db.Column(db.Integer, nullable=False)
+    id_start = db.Column(db.String(36), nullable=False)  # Recipient.id >= id_start
+    id_end = db.Column(db.String(36), nullable=True)  # Recipient.id < id_end (None = hasta el final)
+    status = db.Column(db.String(20), default='pending')  # pending, leased, done
+    
+    # Lease del nodo que lo procesa
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_token = db.Column(db.Integer, default=0)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    
+    # Progreso (se confirma junto con cada envío)
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    campaign = db.relationship('Campaign', backref=db.backref('shards', lazy=True, cascade='all, delete-orphan'))
+    
+    def to_dict(self):
+        return {
+            'shard_index': self.shard_index,
+            'id_start': self.id_start,
+            'id_end': self.id_end,
+            'status': self.status,
+            'lease_owner': self.lease_owner,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'sent_count': self.sent_count,
+            'failed_count': self.failed_count,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
 
 
+class EngagementRollup(db.Model):
+    """Contadores de una campaña en un minuto u hora (se actualizan con upserts incrementales)"""
+    __tablename__ = 'engagement_rollups'
+    __table_args__ = (db.UniqueConstraint('campaign_id', 'granularity', 'bucket'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # minute, hour
+    bucket = db.Column(db.DateTime, nullable=False)  # Inicio del minuto/hora (UTC)
+    sends = db.Column(db.Integer, default=0, nullable=False)
+    opens = db.Column(db.Integer, default=0, nullable=False)  # Todas las cargas del pixel
+    unique_opens = db.Column(db.Integer, default=0, nullable=False)  # Primera apertura de cada destinatario
+    clicks = db.Column(db.Integer, default=0, nullable=False)
+    unique_clicks = db.Column(db.Integer, default=0, nullable=False)
+    machine_opens = db.Column(db.Integer, default=0, nullable=False)  # Proxies de privacidad y bots
+    machine_clicks = db.Column(db.Integer, default=0, nullable=False)  # Escáneres de enlaces
 
 
+class DomainMXCache(db.Model):
+    """Resultado de la comprobación DNS de un dominio, compartido entre importaciones"""
+    __tablename__ = 'domain_mx_cache'
+    
+    domain = db.Column(db.String(255), primary_key=True)  # En minúsculas
+    accepts_mail = db.Column(db.Boolean, nullable=False)  # Tiene MX (o A) y no es un MX nulo
+    checked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
 
 
+class CampaignLink(db.Model):
+    """Destino de un enlace de la campaña; los emails enlazan a /c/<token>/<link_id>"""
+    __tablename__ = 'campaign_links'
+    __table_args__ = (db.UniqueConstraint('campaign_id', 'link_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id'), nullable=False, index=True)
+    link_id = db.Column(db.Integer, nullable=False)  # 1..N dentro de la campaña
+    url = db.Column(db.Text, nullable=False)
+    
+    campaign = db.relationship('Campaign', backref=db.backref('links', lazy=True, cascade='all, delete-orphan'))
 
 
+class ImportJob(db.Model):
+    """Importación de un CSV de destinatarios procesada en segundo plano"""
+    __tablename__ = 'import_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    campaign_id = db.Column(db.String(36), db.ForeignKey('campaigns.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=True)  # Nombre original del archivo subido
+    file_path = db.Column(db.String(500), nullable=False)  # Copia en la carpeta uploads/
+    encoding = db.Column(db.String(20), nullable=True)  # Detectado en la primera ejecución
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed, cancelled
+    
+    # Progreso (se guarda junto con cada bloque confirmado)
+    rows_parsed = db.Column(db.Integer, default=0)
+    accepted = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    duplicates = db.Column(db.Integer, default=0)
+    typos = db.Column(db.Integer, default=0)  # Dominios mal escritos (gmial.com...), incluidos en skipped
+    invalid_domains = db.Column(db.Integer, default=0)  # Dominios sin MX, incluidos en skipped
+    suggestions = db.Column(db.Text, nullable=True)  # JSON con las primeras correcciones sugeridas
+    committed_rows = db.Column(db.Integer, default=0)  # Filas de datos ya confirmadas (punto de reanudación)
+    error_message = db.Column(db.Text, nullable=True)
+    errors = db.Column(db.Text, nullable=True)  # JSON con los primeros errores por línea
+    error_count = db.Column(db.Integer, default=0)
+    
+    # Worker que la procesa y último latido, para reanudar importaciones interrumpidas
+    worker_id = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    campaign = db.relationship('Campaign', backref=db.backref('import_jobs', lazy=True, cascade='all, delete-orphan'))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'campaign_id': self.campaign_id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_parsed': self.rows_parsed,
+            'accepted': self.accepted,
+            'skipped': self.skipped,
+            'duplicates': self.duplicates,
+            'typos': self.typos or 0,
+            'invalid_domains': self.invalid_domains or 0,
+            'suggestions': json.loads(self.suggestions) if self.suggestions else [],
+            'committed_rows': self.committed_rows,
+            'error_message': self.error_message,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'error_count': self.error_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,280 @@
+"""
+Instrumentación opcional para encontrar dónde se va el tiempo.
+
+- Peticiones HTTP (PROFILING_ENABLED): duración y consultas SQL de cada petición (eventos
+  de cursor de SQLAlchemy), en la cabecera Server-Timing y como log estructurado cuando la
+  petición supera SLOW_REQUEST_MS.
+- Etapas del envío (PROFILING_ENABLED): render, encode, smtp y persist de cada mensaje,
+  agregadas por hilo y registradas cada PROFILE_LOG_EVERY mensajes.
+- Perfilador por muestreo del envío (PROFILE_SENDER, o activado en caliente desde la API):
+  muestrea la pila del hilo que envía y guarda un perfil en formato "collapsed stacks"
+  (flamegraph.pl, speedscope) en PROFILE_DIR.
+
+Con todo desactivado no se registra ningún evento ni hook: cada etapa cuesta una
+comparación y un contexto vacío.
+
+Los logs son una línea JSON por evento en la salida estándar.
+"""
+
+from flask import g, request, has_app_context
+from models import db
+from config import Config
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from sqlalchemy import event
+import json
+import os
+import sys
+import threading
+import time
+
+
+PROFILE_SUFFIX = '.folded'
+SAMPLER_FLAG = '.sampler-enabled'  # Archivo que activa el muestreo en todos los procesos
+MAX_LISTED_PROFILES = 100
+MAX_SQL_LENGTH = 300
+
+
+def log_event(event_name, **fields):
+    """Una línea JSON por evento"""
+    record = {'event': event_name, 'ts': datetime.utcnow().isoformat(), 'pid': os.getpid(), **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+# ============ PETICIONES HTTP ============
+
+def init_app(app):
+    """Registra los hooks de peticiones y SQL; sin PROFILING_ENABLED no registra nada"""
+    if not Config.PROFILING_ENABLED:
+        return
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor)
+    event.listen(engine, 'after_cursor_execute', _after_cursor)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    # En el contexto de la ejecución: si la sentencia falla se descarta con él
+    context._profile_started = time.perf_counter()
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    started = context._profile_started
+    if not has_app_context():
+        return
+    stats = g.get('profile_sql')
+    if stats is None:
+        return  # Consultas de hilos en segundo plano
+    elapsed = (time.perf_counter() - started) * 1000
+    stats['count'] += 1
+    stats['ms'] += elapsed
+    if elapsed > stats['slowest_ms']:
+        stats['slowest_ms'] = elapsed
+        stats['slowest'] = statement[:MAX_SQL_LENGTH]
+
+
+def _start_request():
+    g.profile_started = time.perf_counter()
+    g.profile_sql = {'count': 0, 'ms': 0.0, 'slowest_ms': 0.0, 'slowest': None}
+
+
+def _finish_request(response):
+    started = g.get('profile_started')
+    if started is None:
+        return response
+
+    duration = (time.perf_counter() - started) * 1000
+    sql = g.profile_sql
+    response.headers['Server-Timing'] = (
+        f'app;dur={duration:.1f}, sql;dur={sql["ms"]:.1f};desc="{sql["count"]} queries"'
+    )
+
+    if duration >= Config.SLOW_REQUEST_MS:
+        log_event(
+            'slow_request',
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code,
+            duration_ms=round(duration, 1),
+            sql_queries=sql['count'],
+            sql_ms=round(sql['ms'], 1),
+            slowest_sql=sql['slowest'],
+            slowest_sql_ms=round(sql['slowest_ms'], 1)
+        )
+    return response
+
+
+# ============ ETAPAS DEL ENVÍO ============
+
+_local = threading.local()
+_NULL_STAGE = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        stages = _stages()
+        count, total, slowest = stages.get(self.name, (0, 0.0, 0.0))
+        stages[self.name] = (count + 1, total + elapsed, max(slowest, elapsed))
+        return False
+
+
+def _stages():
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        stages = _local.stages = {}
+        _local.messages = 0
+    return stages
+
+
+def stage(name):
+    """Mide una etapa del mensaje en curso: `with stage('smtp'): ...`"""
+    if not Config.PROFILING_ENABLED:
+        return _NULL_STAGE
+    return _StageTimer(name)
+
+
+def message_done(**context):
+    """Cierra un mensaje; cada PROFILE_LOG_EVERY mensajes registra el agregado de etapas"""
+    if not Config.PROFILING_ENABLED:
+        return
+    _stages()
+    _local.messages += 1
+    if _local.messages >= Config.PROFILE_LOG_EVERY:
+        flush_stages(**context)
+
+
+def flush_stages(**context):
+    """Registra y reinicia el agregado de etapas del hilo (al terminar un envío)"""
+    stages = getattr(_local, 'stages', None)
+    if not stages:
+        return
+    log_event(
+        'send_stages',
+        messages=_local.messages,
+        **context,
+        stages={
+            name: {
+                'count': count,
+                'total_ms': round(total, 1),
+                'avg_ms': round(total / count, 2),
+                'max_ms': round(slowest, 1)
+            }
+            for name, (count, total, slowest) in stages.items()
+        }
+    )
+    _local.stages = {}
+    _local.messages = 0
+
+
+# ============ PERFILADOR POR MUESTREO ============
+
+def profile_dir():
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    return Config.PROFILE_DIR
+
+
+def sampler_enabled():
+    """Activo por configuración o por el archivo de la API (visible para todos los workers)"""
+    return Config.PROFILE_SENDER or os.path.exists(os.path.join(Config.PROFILE_DIR, SAMPLER_FLAG))
+
+
+def set_sampler(enabled):
+    flag = os.path.join(profile_dir(), SAMPLER_FLAG)
+    if enabled:
+        open(flag, 'a').close()
+    elif os.path.exists(flag):
+        os.remove(flag)
+
+
+class StackSampler:
+    """Muestrea periódicamente la pila de un hilo y cuenta las pilas repetidas"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break  # El hilo terminó
+            self.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+
+    def _collapse(self, frame):
+        """Pila como 'raíz;...;hoja', una etiqueta por función"""
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = (
+                    f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+                )
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+
+@contextmanager
+def sender_profile(name):
+    """Perfila el hilo actual mientras dura el bloque si el muestreo está activo"""
+    if not sampler_enabled():
+        yield
+        return
+
+    sampler = StackSampler(threading.get_ident(), Config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        filename = f'{name}-{os.getpid()}-{datetime.utcnow():%Y%m%d%H%M%S}{PROFILE_SUFFIX}'
+        with open(os.path.join(profile_dir(), filename), 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        log_event('sender_profile', name=name, samples=sampler.samples, file=filename)
+
+
+def list_profiles():
+    """Perfiles guardados, del más reciente al más antiguo"""
+    if not os.path.isdir(Config.PROFILE_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(Config.PROFILE_DIR):
+        if entry.is_file() and entry.name.endswith(PROFILE_SUFFIX):
+            stat = entry.stat()
+            profiles.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+            })
+    profiles.sort(key=lambda profile: profile['created_at'], reverse=True)
+    return profiles[:MAX_LISTED_PROFILES]
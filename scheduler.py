@@ -0,0 +1,341 @@
+"""
+Scheduler de campañas programadas.
+
+Un único hilo por servidor (coordinado entre workers de gunicorn con un file lock) reparte
+el rate global de SES entre las campañas activas usando una cola justa ponderada
+(start-time fair queueing), respetando para cada campaña su hora de inicio, la ventana
+objetivo de envío y el tope opcional de envíos por hora. Todo el estado vive en
+`campaign_schedules`, así que tras un reinicio el envío continúa donde se quedó.
+"""
+
+from models import db, Campaign, Recipient, CampaignSchedule
+from mailer import send_email_smtp, message_template
+from domain_pacing import DomainPacer, keyset_pages, is_deferral
+from profiling import stage, message_done, sender_profile, sampler_enabled
+from config import Config
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+import threading
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin coordinación entre procesos
+    fcntl = None
+
+
+class CampaignScheduler:
+    """Hilo de envío paced para campañas con programación"""
+
+    IDLE_POLL_SECONDS = 5        # Espera máxima cuando no hay nada que enviar
+    REFRESH_SECONDS = 1.0        # Cada cuánto se releen las programaciones (detecta stop/nuevas)
+    LOCK_RETRY_SECONDS = 30      # Reintento del lock si otro worker ya tiene el scheduler
+    PREFETCH = 1000              # Destinatarios pendientes leídos por consulta
+
+    def __init__(self, app, lock_path=None):
+        self.app = app
+        self.lock_path = lock_path or os.path.join(app.instance_path, 'scheduler.lock')
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._lock_file = None
+        self._queues = {}        # campaign_id -> DomainPacer con los pendientes leídos
+        self._templates = {}     # campaign_id -> datos del mensaje (message_template)
+        self._blocked = {}       # campaign_id -> monotonic hasta el que sus dominios esperan
+        self._vclock = None      # Tiempo virtual del sistema (SFQ)
+        self._profiling = False  # Perfil por muestreo abierto (sender_profile)
+
+    def start(self):
+        """Arranca el hilo del scheduler una sola vez por proceso"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='campaign-scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wake(self):
+        """Despierta al scheduler para que relea las programaciones"""
+        self._wake.set()
+
+    def _sleep(self, seconds):
+        # No se limpia el evento: el bucle lo consume al releer las programaciones
+        if seconds > 0:
+            self._wake.wait(seconds)
+
+    def _acquire_process_lock(self):
+        """Solo un proceso del servidor ejecuta el scheduler; los demás esperan su turno"""
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._acquire_process_lock():
+            time.sleep(self.LOCK_RETRY_SECONDS)
+
+        while True:
+            with self.app.app_context():
+                try:
+                    self._loop()
+                except Exception as e:
+                    print(f"Error en scheduler: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._queues.clear()
+            self._templates.clear()
+            self._blocked.clear()
+            self._profiling = False
+            time.sleep(self.IDLE_POLL_SECONDS)
+
+    # ============ BUCLE PRINCIPAL ============
+
+    def _loop(self):
+        with ExitStack() as profile:
+            self._send_loop(profile)
+
+    def _send_loop(self, profile):
+        last_send = 0.0
+        schedules = []
+        refreshed_at = 0.0
+
+        while True:
+            now = datetime.utcnow()
+
+            if time.monotonic() - refreshed_at >= self.REFRESH_SECONDS or self._wake.is_set():
+                self._wake.clear()
+                schedules = self._refresh(now)
+                refreshed_at = time.monotonic()
+                self._update_profile(profile, schedules)
+
+            schedule, wait = self._pick(schedules, now)
+            if schedule is None:
+                self._sleep(min(wait, self.IDLE_POLL_SECONDS))
+                continue
+
+            recipient, blocked = self._next_recipient(schedule)
+            if recipient is None:
+                if blocked is not None:
+                    # Todos sus dominios están en pausa: ceder el turno a otras campañas
+                    self._blocked[schedule.campaign_id] = time.monotonic() + blocked
+                    continue
+                self._finish(schedule)
+                schedules = [s for s in schedules if s is not schedule]
+                continue
+            pacer = self._queues[schedule.campaign_id]
+            recipient_id = recipient.id
+            # Leído una vez por campaña: cada commit expira la campaña y recargarla por
+            # mensaje leería su HTML completo
+            template = self._templates.get(schedule.campaign_id)
+            if template is None:
+                template = self._templates[schedule.campaign_id] = message_template(schedule.campaign)
+
+            try:
+                # Rate global compartido por todas las campañas
+                delay = last_send + 1.0 / Config.SES_MAX_SEND_RATE - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                # La conexión sale del pool SMTP del proceso (se mantiene caliente entre campañas)
+                success, error = send_email_smtp(recipient, template)
+                last_send = time.monotonic()
+
+                if success:
+                    recipient.sent = True
+                    recipient.sent_at = datetime.utcnow()
+                    pacer.success(recipient.id)
+                elif is_deferral(error) and pacer.deferred(recipient.id):
+                    # El dominio receptor pidió reintentar más tarde: sigue pendiente
+                    pass
+                else:
+                    recipient.error_message = error
+                    pacer.failed(recipient.id)
+
+                self._account(schedule, now)
+                with stage('persist'):
+                    db.session.commit()
+                db.session.expunge(recipient)
+                message_done(source='scheduler')
+            finally:
+                # Con excepción el recipient no reporta resultado: liberar el hueco del dominio
+                pacer.release(recipient_id)
+
+    def _update_profile(self, profile, schedules):
+        """
+        Con el muestreo activo, un perfil por periodo con campañas enviando: el hilo no
+        termina, así que el perfil se guarda al quedarse sin trabajo o al desactivarlo
+        """
+        busy = sampler_enabled() and any(s.status == 'active' for s in schedules)
+        if busy and not self._profiling:
+            profile.enter_context(sender_profile('scheduler'))
+            self._profiling = True
+        elif not busy and self._profiling:
+            profile.close()
+            self._profiling = False
+
+    # ============ ESTADO DE LAS PROGRAMACIONES ============
+
+    def _refresh(self, now):
+        """Relee las programaciones vivas, activa las que llegan a su hora y pausa las detenidas"""
+        rows = (
+            db.session.query(CampaignSchedule, Campaign)
+            .join(Campaign, Campaign.id == CampaignSchedule.campaign_id)
+            .options(db.defer(Campaign.html_content))
+            .filter(CampaignSchedule.status.in_(['pending', 'active']))
+            .order_by(CampaignSchedule.created_at)
+            .populate_existing()
+            .all()
+        )
+
+        schedules = []
+        changed = False
+        for schedule, campaign in rows:
+            if campaign.status not in ('scheduled', 'sending'):
+                # Detenida desde la API: se reanuda con un nuevo POST /send
+                schedule.status = 'paused'
+                self._queues.pop(campaign.id, None)
+                self._templates.pop(campaign.id, None)
+                self._blocked.pop(campaign.id, None)
+                changed = True
+                continue
+
+            if schedule.status == 'pending' and schedule.start_at <= now:
+                self._activate(schedule, campaign, now)
+                changed = True
+
+            schedules.append(schedule)
+
+        if changed:
+            db.session.commit()
+
+        active = [s.virtual_time or 0.0 for s in schedules if s.status == 'active']
+        if self._vclock is None and active:
+            self._vclock = min(active)
+
+        return schedules
+
+    def _activate(self, schedule, campaign, now):
+        schedule.status = 'active'
+        schedule.total_planned = Recipient.query.filter_by(
+            campaign_id=campaign.id, sent=False, error_message=None
+        ).count()
+        schedule.sent_count = 0
+        schedule.hour_window_start = None
+        schedule.hour_window_count = 0
+        # Una campaña que entra no hereda crédito: arranca en el tiempo virtual actual
+        schedule.virtual_time = max(schedule.virtual_time or 0.0, self._vclock or 0.0)
+        campaign.status = 'sending'
+        if not campaign.sent_at:
+            campaign.sent_at = now
+
+    def _next_eligible_at(self, schedule, now):
+        """Momento a partir del cual la campaña puede enviar otro email (now si ya puede)"""
+        eligible_at = now
+
+        # Ritmo uniforme dentro de la ventana objetivo
+        if schedule.window_minutes and schedule.total_planned:
+            window = timedelta(minutes=schedule.window_minutes)
+            slot = schedule.start_at + window * (schedule.sent_count / schedule.total_planned)
+            eligible_at = max(eligible_at, slot)
+
+        # Tope de envíos por hora
+        if schedule.hourly_cap and schedule.hour_window_start:
+            hour_end = schedule.hour_window_start + timedelta(hours=1)
+            if now < hour_end and schedule.hour_window_count >= schedule.hourly_cap:
+                eligible_at = max(eligible_at, hour_end)
+
+        return eligible_at
+
+    def _pick(self, schedules, now):
+        """
+        Elige la campaña a servir: entre las elegibles, la de menor tiempo virtual.
+        Retorna (schedule, None) o (None, segundos hasta la próxima elegibilidad).
+        """
+        best = None
+        wait = self.IDLE_POLL_SECONDS
+
+        for schedule in schedules:
+            if schedule.status == 'pending':
+                wait = min(wait, (schedule.start_at - now).total_seconds())
+                continue
+
+            blocked = self._blocked.get(schedule.campaign_id, 0) - time.monotonic()
+            if blocked > 0:
+                wait = min(wait, blocked)
+                continue
+
+            eligible_at = self._next_eligible_at(schedule, now)
+            if eligible_at > now:
+                wait = min(wait, (eligible_at - now).total_seconds())
+                continue
+
+            # Una campaña que vuelve a tener trabajo no acumula crédito del tiempo inactivo
+            if self._vclock is not None and (schedule.virtual_time or 0.0) < self._vclock:
+                schedule.virtual_time = self._vclock
+
+            if best is None or schedule.virtual_time < best.virtual_time:
+                best = schedule
+
+        if best is None:
+            return None, max(wait, 0.05)
+        return best, None
+
+    def _account(self, schedule, now):
+        """Registra un envío en el estado persistido de la programación"""
+        self._vclock = schedule.virtual_time
+        schedule.virtual_time = (schedule.virtual_time or 0.0) + 1.0 / (schedule.weight or 1.0)
+        schedule.sent_count = (schedule.sent_count or 0) + 1
+
+        if not schedule.hour_window_start or now - schedule.hour_window_start >= timedelta(hours=1):
+            schedule.hour_window_start = now
+            schedule.hour_window_count = 0
+        schedule.hour_window_count += 1
+
+    def _next_recipient(self, schedule):
+        """
+        Siguiente recipient de la campaña, intercalado por dominio. Retorna (recipient, None),
+        (None, segundos) si todos sus dominios están en pausa o (None, None) si no quedan.
+        """
+        pacer = self._queues.get(schedule.campaign_id)
+
+        while True:
+            if not pacer:
+                # Nueva pasada por los pendientes (también recoge los agregados durante el envío)
+                pending = db.session.query(Recipient.id, Recipient.domain).filter_by(
+                    campaign_id=schedule.campaign_id, sent=False, error_message=None
+                )
+                pacer = DomainPacer(source=keyset_pages(pending, Recipient.id), lookahead=self.PREFETCH)
+                if not pacer:
+                    self._queues.pop(schedule.campaign_id, None)
+                    self._templates.pop(schedule.campaign_id, None)
+                    return None, None
+                self._queues[schedule.campaign_id] = pacer
+
+            recipient_id, wait = pacer.next()
+            if recipient_id is None:
+                return None, wait
+
+            recipient = db.session.get(Recipient, recipient_id)
+            if recipient and not recipient.sent and not recipient.error_message:
+                return recipient, None
+            pacer.failed(recipient_id)
+
+    def _finish(self, schedule):
+        """Sin pendientes: cerrar la programación y fijar el estado final de la campaña"""
+        campaign = schedule.campaign
+        total_errors = Recipient.query.filter(
+            Recipient.campaign_id == campaign.id,
+            Recipient.error_message != None
+        ).count()
+        campaign.status = 'sent' if total_errors == 0 else 'sent_with_errors'
+        schedule.status = 'done'
+        db.session.commit()
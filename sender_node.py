@@ -0,0 +1,47 @@
+"""
+Nodo de envío: toma shards de campañas enviadas con {"sharded": true} y los envía.
+
+Se pueden lanzar tantos nodos como se quiera, en esta máquina o en otras, siempre que
+compartan la base de datos (DATABASE_URL). Si un nodo muere, otro retoma sus shards
+cuando caduca el lease (SHARD_LEASE_SECONDS).
+
+Uso:
+    python sender_node.py                    # Nodo permanente
+    python sender_node.py --node-id nodo-2   # Identificador explícito
+    python sender_node.py --exit-when-idle   # Sale cuando no quedan shards pendientes
+"""
+
+from flask import Flask
+from models import db
+from config import Config
+from sharding import ShardWorker
+from analytics import analytics
+import argparse
+
+
+def create_app():
+    """App mínima: solo la base de datos (el nodo no sirve HTTP)"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Varios procesos escribiendo en el mismo archivo: esperar al lock en lugar de fallar
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    db.init_app(app)
+    analytics.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Nodo de envío de campañas por shards')
+    parser.add_argument('--node-id', help='Identificador del nodo (por defecto host:pid)')
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help='Salir cuando no queden shards pendientes')
+    args = parser.parse_args()
+
+    worker = ShardWorker(create_app(), node_id=args.node_id)
+    try:
+        worker.run(exit_when_idle=args.exit_when_idle)
+    except KeyboardInterrupt:
+        print("\nNodo detenido")
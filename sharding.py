@@ -0,0 +1,292 @@
+"""
+Envío repartido entre varios nodos.
+
+Una campaña se parte en shards por rango de id de recipient (los ids son UUID en hex,
+así que los rangos se reparten uniformemente). Cada nodo (`sender_node.py`) toma un shard
+en lease con un UPDATE atómico, lo renueva mientras envía y lo libera al terminar. Si un
+nodo muere, su lease caduca y otro nodo retoma el shard con los recipients que sigan
+pendientes.
+
+Cada envío se confirma en la misma transacción que renueva el lease comprobando el
+`lease_token` (fencing): un nodo que perdió su lease no puede marcar recipients ni sumar
+progreso. El lease se renueva también justo antes de cada envío, de modo que solo un nodo
+detenido más de SHARD_LEASE_SECONDS entre la renovación y el envío podría duplicarlo.
+Los contadores de la campaña salen de los propios recipients; los de cada shard
+permiten seguir el progreso por nodo.
+"""
+
+from models import db, Campaign, Recipient, SendShard
+from mailer import send_email_smtp, message_template
+from domain_pacing import DomainPacer, keyset_pages, is_deferral
+from smtp_pool import smtp_pool
+from profiling import stage, message_done, flush_stages, sender_profile
+from config import Config
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+import os
+import socket
+import time
+
+
+ID_SPACE = 16 ** 8  # Los primeros 8 dígitos hex del UUID definen el rango
+
+
+def shard_boundaries(count):
+    """Límites [inicio, fin) de `count` rangos uniformes sobre el espacio de ids"""
+    starts = [format(i * ID_SPACE // count, '08x') for i in range(count)]
+    return [(start, starts[i + 1] if i + 1 < count else None) for i, start in enumerate(starts)]
+
+
+def create_shards(campaign, count):
+    """Reemplaza los shards de la campaña por `count` rangos nuevos (sin confirmar)"""
+    # Un nodo que aún tenga un shard viejo pierde el lease: su fencing ya no encuentra la fila
+    SendShard.query.filter_by(campaign_id=campaign.id).delete(synchronize_session=False)
+    shards = [
+        SendShard(campaign_id=campaign.id, shard_index=index, id_start=start, id_end=end)
+        for index, (start, end) in enumerate(shard_boundaries(count))
+    ]
+    db.session.add_all(shards)
+    return shards
+
+
+def close_shards(campaign):
+    """
+    Elimina los shards abiertos para enviar la campaña por otra vía (sin confirmar: va en
+    la transacción que la reanuda). Los nodos dejan de encontrarlos y su fencing falla.
+    Retorna False si un nodo aún tiene un lease vigente: podría estar enviando.
+    """
+    open_shards = SendShard.query.filter(SendShard.campaign_id == campaign.id, SendShard.status != 'done')
+    if open_shards.filter(SendShard.status == 'leased', SendShard.lease_expires_at >= datetime.utcnow()).first():
+        return False
+    open_shards.delete(synchronize_session=False)
+    return True
+
+
+def shard_filter(shard):
+    """Condición SQL de los recipients del shard"""
+    conditions = [Recipient.campaign_id == shard.campaign_id, Recipient.id >= shard.id_start]
+    if shard.id_end:
+        conditions.append(Recipient.id < shard.id_end)
+    return and_(*conditions)
+
+
+class LeaseLost(Exception):
+    """El shard fue reasignado a otro nodo (o eliminado)"""
+
+
+class ShardWorker:
+    """Bucle de un nodo de envío: toma shards en lease y los envía"""
+
+    IDLE_POLL_SECONDS = 5        # Espera cuando no hay shards libres
+
+    def __init__(self, app, node_id=None):
+        self.app = app
+        self.node_id = node_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease_seconds = Config.SHARD_LEASE_SECONDS
+        self.send_interval = 1.0 / Config.SENDER_NODE_SEND_RATE
+        self._last_send = 0.0
+
+    def run(self, exit_when_idle=False):
+        """Procesa shards indefinidamente (o hasta que no quede trabajo pendiente)"""
+        print(f"Nodo de envío {self.node_id} iniciado")
+        while True:
+            with self.app.app_context():
+                try:
+                    shard = self._lease()
+                    if shard is not None:
+                        with sender_profile(f'shard-{shard.campaign_id}-{shard.shard_index}'):
+                            self._process(shard)
+                        continue
+                    if exit_when_idle and not self._work_remaining():
+                        break
+                except Exception as e:
+                    print(f"Error en nodo {self.node_id}: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+            time.sleep(self.IDLE_POLL_SECONDS)
+
+        smtp_pool.close_all()
+        print(f"Nodo de envío {self.node_id} sin trabajo pendiente, saliendo")
+
+    # ============ LEASES ============
+
+    def _available(self, now):
+        """Shards libres o con el lease caducado, de campañas que se están enviando"""
+        return and_(
+            Campaign.status == 'sending',
+            or_(
+                SendShard.status == 'pending',
+                and_(SendShard.status == 'leased', SendShard.lease_expires_at < now)
+            )
+        )
+
+    def _work_remaining(self):
+        return db.session.query(SendShard.id).join(Campaign).filter(
+            Campaign.status == 'sending', SendShard.status != 'done'
+        ).first() is not None
+
+    def _lease(self):
+        """Toma un shard de forma atómica. Retorna el shard o None"""
+        now = datetime.utcnow()
+        candidates = [
+            row.id for row in
+            db.session.query(SendShard.id).join(Campaign)
+            .filter(self._available(now))
+            .order_by(SendShard.status.desc(), SendShard.shard_index)  # pending antes que caducados
+            .limit(10)
+        ]
+
+        for shard_id in candidates:
+            claimed = SendShard.query.filter(
+                SendShard.id == shard_id,
+                or_(
+                    SendShard.status == 'pending',
+                    and_(SendShard.status == 'leased', SendShard.lease_expires_at < now)
+                )
+            ).update({
+                'status': 'leased',
+                'lease_owner': self.node_id,
+                'lease_token': SendShard.lease_token + 1,
+                'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                'heartbeat_at': now
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed == 1:
+                shard = db.session.get(SendShard, shard_id)
+                print(f"Nodo {self.node_id}: shard {shard.shard_index} de la campaña {shard.campaign_id} (token {shard.lease_token})")
+                return shard
+        return None
+
+    def _fence(self, shard, sent=0, failed=0, **values):
+        """
+        Renueva el lease y suma progreso si el token sigue vigente. No confirma: va en la
+        transacción del envío. Lanza LeaseLost si otro nodo tiene el shard.
+        """
+        now = datetime.utcnow()
+        values = {
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+            'heartbeat_at': now,
+            **values
+        }
+        if sent:
+            values['sent_count'] = SendShard.sent_count + sent
+        if failed:
+            values['failed_count'] = SendShard.failed_count + failed
+
+        updated = SendShard.query.filter_by(
+            id=shard.id, lease_owner=self.node_id, lease_token=shard.lease_token
+        ).update(values, synchronize_session=False)
+        if updated != 1:
+            raise LeaseLost()
+
+    def _renew(self, shard):
+        self._fence(shard)
+        db.session.commit()
+
+    def _release(self, shard, status):
+        """Termina (done) o devuelve (pending) el shard"""
+        values = {'status': status, 'lease_expires_at': None}
+        if status == 'done':
+            values['finished_at'] = datetime.utcnow()  # lease_owner queda como el nodo que lo terminó
+        else:
+            values['lease_owner'] = None
+        self._fence(shard, **values)
+        db.session.commit()
+
+    # ============ ENVÍO DE UN SHARD ============
+
+    def _process(self, shard):
+        campaign_id = shard.campaign_id
+        # Copia de los datos del mensaje: cada commit expira la campaña
+        campaign = message_template(db.session.get(Campaign, campaign_id))
+        pending = db.session.query(Recipient.id, Recipient.domain).filter(
+            shard_filter(shard), Recipient.sent == False, Recipient.error_message == None
+        )
+        pacer = DomainPacer(source=keyset_pages(pending, Recipient.id))
+
+        try:
+            while True:
+                recipient_id, wait = pacer.next()
+                if recipient_id is None:
+                    if wait is None:
+                        break
+                    # Todos los dominios del shard en pausa: mantener vivo el lease
+                    time.sleep(min(wait, self.lease_seconds / 3))
+                    self._renew(shard)
+                    continue
+
+                try:
+                    status = db.session.query(Campaign.status).filter_by(id=campaign_id).scalar()
+                    if status != 'sending':
+                        # Detenida desde la API: el shard vuelve a estar libre para cuando se reanude
+                        self._release(shard, 'pending')
+                        return
+
+                    recipient = db.session.get(Recipient, recipient_id)
+                    if recipient is None or recipient.sent or recipient.error_message:
+                        pacer.failed(recipient_id)
+                        continue
+
+                    # Renovar justo antes de enviar: no se envía con un lease a punto de caducar
+                    self._renew(shard)
+                    success, error = self._send(recipient, campaign)
+
+                    with stage('persist'):
+                        if success:
+                            recipient.sent = True
+                            recipient.sent_at = datetime.utcnow()
+                            pacer.success(recipient_id)
+                            self._fence(shard, sent=1)
+                        elif is_deferral(error) and pacer.deferred(recipient_id):
+                            # El dominio receptor pidió reintentar más tarde: sigue pendiente
+                            self._fence(shard)
+                        else:
+                            recipient.error_message = error
+                            pacer.failed(recipient_id)
+                            self._fence(shard, failed=1)
+                        db.session.commit()
+                    db.session.expunge(recipient)
+                    message_done(campaign_id=campaign_id, node=self.node_id)
+                finally:
+                    # Detenida o con excepción (LeaseLost...): el hueco del dominio no
+                    # queda ocupado en este nodo
+                    pacer.release(recipient_id)
+
+            flush_stages(campaign_id=campaign_id, node=self.node_id)
+            self._release(shard, 'done')
+            self._finish_campaign(campaign_id)
+
+        except LeaseLost:
+            db.session.rollback()
+            print(f"Nodo {self.node_id}: perdió el lease del shard {shard.id}, se abandona")
+
+    def _send(self, recipient, campaign):
+        # Rate del nodo
+        delay = self._last_send + self.send_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        success, error = send_email_smtp(recipient, campaign)
+        self._last_send = time.monotonic()
+        return success, error
+
+    def _finish_campaign(self, campaign_id):
+        """El nodo que termina el último shard fija el estado final de la campaña"""
+        unfinished = SendShard.query.filter(
+            SendShard.campaign_id == campaign_id, SendShard.status != 'done'
+        ).count()
+        if unfinished:
+            return
+
+        total_errors = Recipient.query.filter(
+            Recipient.campaign_id == campaign_id,
+            Recipient.error_message != None
+        ).count()
+        Campaign.query.filter_by(id=campaign_id, status='sending').update(
+            {'status': 'sent' if total_errors == 0 else 'sent_with_errors'},
+            synchronize_session=False
+        )
+        db.session.commit()
+        print(f"Campaña {campaign_id} completada por el nodo {self.node_id}")
@@ -0,0 +1,233 @@
+"""
+Pool de conexiones SMTP del proceso.
+
+Abrir una conexión con SES cuesta un connect TCP, el handshake de STARTTLS y el AUTH
+LOGIN. El pool mantiene conexiones ya autenticadas entre mensajes y entre campañas:
+
+- Cada envío toma una conexión (`acquire`) y la devuelve (`release`); si la conexión
+  estuvo inactiva un rato se comprueba con NOOP antes de usarla.
+- Un hilo de mantenimiento manda NOOP a las conexiones inactivas para que el servidor
+  no las cierre y descarta las que superan el tiempo máximo de inactividad.
+- Las conexiones se reciclan por edad o por número de mensajes enviados.
+- Las reconexiones reutilizan la sesión TLS de la conexión anterior (resumption con
+  session tickets), evitando el handshake completo.
+"""
+
+from config import Config
+from collections import deque
+import os
+import smtplib
+import ssl
+import threading
+import time
+
+
+class PooledSMTP(smtplib.SMTP):
+    """SMTP con reanudación de sesión TLS y contadores para el reciclado del pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages = 0
+
+    def starttls(self, context=None, session=None):
+        """Como smtplib.SMTP.starttls, pero pasando `session` al envolver el socket"""
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn('starttls'):
+            raise smtplib.SMTPNotSupportedError('STARTTLS extension not supported by server.')
+        resp, reply = self.docmd('STARTTLS')
+        if resp != 220:
+            raise smtplib.SMTPResponseException(resp, reply)
+
+        context = context or ssl.create_default_context()
+        self.sock = context.wrap_socket(self.sock, server_hostname=self._host, session=session)
+        # Hay que repetir EHLO tras STARTTLS (RFC 3207)
+        self.file = None
+        self.helo_resp = None
+        self.ehlo_resp = None
+        self.esmtp_features = {}
+        self.does_esmtp = False
+        return resp, reply
+
+    def sendmail(self, *args, **kwargs):
+        self.messages += 1
+        return super().sendmail(*args, **kwargs)
+
+    @property
+    def session_reused(self):
+        return bool(getattr(self.sock, 'session_reused', False))
+
+
+class SMTPPool:
+    """Conexiones SMTP autenticadas compartidas por todos los hilos de envío del proceso"""
+
+    def __init__(self):
+        self.max_idle = Config.SMTP_POOL_MAX_IDLE
+        self.max_messages = Config.SMTP_POOL_MAX_MESSAGES
+        self.max_age = Config.SMTP_POOL_MAX_AGE
+        self.idle_timeout = Config.SMTP_POOL_IDLE_TIMEOUT
+        self.noop_after = Config.SMTP_POOL_NOOP_AFTER
+        self.keepalive = Config.SMTP_POOL_KEEPALIVE
+
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._pid = os.getpid()
+        self._ssl_context = ssl.create_default_context()
+        self._tls_session = None
+        self._maintenance = None
+        self._stats = {
+            'connections_opened': 0,
+            'tls_sessions_reused': 0,
+            'reused': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+        }
+
+    # ============ API ============
+
+    def acquire(self):
+        """Conexión autenticada lista para enviar (del pool o nueva)"""
+        self._check_fork()
+        self._start_maintenance()
+
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None  # LIFO: la más reciente
+            if conn is None:
+                return self._connect()
+
+            now = time.monotonic()
+            if self._expired(conn, now):
+                self._discard(conn, 'recycled')
+                continue
+            if now - conn.last_used > self.noop_after and not self._healthy(conn):
+                self._discard(conn, 'health_check_failures')
+                continue
+
+            with self._lock:
+                self._stats['reused'] += 1
+            return conn
+
+    def release(self, conn, broken=False):
+        """Devuelve la conexión al pool; se cierra si falló o ya cumplió su ciclo"""
+        conn.last_used = time.monotonic()
+        if broken:
+            self._close(conn)
+            return
+        if self._expired(conn, conn.last_used):
+            self._discard(conn, 'recycled')
+            return
+
+        with self._lock:
+            if os.getpid() == self._pid and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+    # ============ INTERNOS ============
+
+    def _connect(self):
+        conn = PooledSMTP(Config.SES_SMTP_HOST, Config.SES_SMTP_PORT, timeout=60)
+        try:
+            if Config.SES_SMTP_STARTTLS:
+                conn.starttls(context=self._ssl_context, session=self._tls_session)
+            conn.login(Config.SES_SMTP_USERNAME, Config.SES_SMTP_PASSWORD)
+        except Exception:
+            self._close(conn)
+            raise
+
+        with self._lock:
+            self._stats['connections_opened'] += 1
+            if conn.session_reused:
+                self._stats['tls_sessions_reused'] += 1
+            # Tras el login ya llegó el ticket de sesión (TLS 1.3 lo envía después del handshake)
+            session = getattr(conn.sock, 'session', None)
+            if session is not None:
+                self._tls_session = session
+        return conn
+
+    def _expired(self, conn, now):
+        return (
+            conn.messages >= self.max_messages or
+            now - conn.created_at >= self.max_age or
+            now - conn.last_used >= self.idle_timeout
+        )
+
+    def _healthy(self, conn):
+        try:
+            return conn.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, conn, reason):
+        with self._lock:
+            self._stats[reason] += 1
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except:
+            try:
+                conn.close()
+            except:
+                pass
+
+    def _check_fork(self):
+        """Tras un fork las conexiones heredadas pertenecen al proceso padre: no se usan"""
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._pid = os.getpid()
+                    self._idle = deque()
+                    self._maintenance = None
+
+    def _start_maintenance(self):
+        if self._maintenance is not None:
+            return
+        with self._lock:
+            if self._maintenance is not None:
+                return
+            self._maintenance = threading.Thread(target=self._maintain, name='smtp-pool')
+            self._maintenance.daemon = True
+            self._maintenance.start()
+
+    def _maintain(self):
+        """NOOP a las conexiones inactivas y cierre de las caducadas"""
+        while True:
+            time.sleep(self.keepalive)
+            with self._lock:
+                idle, self._idle = list(self._idle), deque()
+
+            keep = []
+            now = time.monotonic()
+            for conn in idle:
+                if self._expired(conn, now):
+                    self._discard(conn, 'recycled')
+                elif self._healthy(conn):
+                    keep.append(conn)  # NOOP no cuenta como uso: last_used no cambia
+                else:
+                    self._discard(conn, 'health_check_failures')
+
+            with self._lock:
+                # Las devueltas mientras tanto van después (son las más recientes)
+                self._idle = deque(keep + list(self._idle))
+                extra = [self._idle.popleft() for _ in range(len(self._idle) - self.max_idle)]
+            for conn in extra:
+                self._close(conn)
+
+
+# Pool compartido por el scheduler y los nodos de envío del proceso
+smtp_pool = SMTPPool()
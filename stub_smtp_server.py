@@ -0,0 +1,124 @@
+"""
+Servidor SMTP de prueba para desarrollo local: acepta cualquier AUTH y cualquier
+mensaje sin entregarlo, y registra una línea por destinatario aceptado.
+
+No soporta STARTTLS: los procesos que lo usen deben tener SES_SMTP_STARTTLS=false.
+
+Uso:
+    python stub_smtp_server.py --port 2525 --log rcpts.log
+    python stub_smtp_server.py --defer-rate 0.05   # Responde 451 al 5% de los mensajes
+"""
+
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Una conexión SMTP: EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def handle(self):
+        server = self.server
+        rcpts = []
+        self.reply('220 stub-smtp ESMTP listo')
+
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            command = line[:4].upper()
+
+            if command in ('EHLO', 'HELO'):
+                if command == 'HELO':
+                    self.reply('250 stub-smtp')
+                else:
+                    self.reply('250-stub-smtp')
+                    self.reply('250-AUTH PLAIN LOGIN')
+                    self.reply('250 8BITMIME')
+            elif command == 'AUTH':
+                parts = line.split()
+                if len(parts) == 2 and parts[1].upper() == 'LOGIN':
+                    # Usuario y contraseña en dos rondas; se acepta cualquier valor
+                    self.reply('334 VXNlcm5hbWU6')
+                    self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                elif len(parts) == 2:
+                    self.reply('334 ')
+                    self.rfile.readline()
+                self.reply('235 2.7.0 Autenticado')
+            elif command == 'MAIL':
+                rcpts = []
+                self.reply('250 2.1.0 OK')
+            elif command == 'RCPT':
+                rcpts.append(line.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 2.1.5 OK')
+            elif command == 'DATA':
+                self.reply('354 Fin con <CRLF>.<CRLF>')
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                if server.delay:
+                    time.sleep(server.delay)
+                if server.defer_rate and random.random() < server.defer_rate:
+                    self.reply('451 4.3.0 Try again later')
+                else:
+                    server.record(rcpts)
+                    self.reply('250 2.0.0 Aceptado')
+                rcpts = []
+            elif command == 'RSET':
+                rcpts = []
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Adiós')
+                return
+            else:
+                self.reply('502 Comando no implementado')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, log_path=None, delay=0.0, defer_rate=0.0):
+        super().__init__(address, StubSMTPHandler)
+        self.log_path = log_path
+        self.delay = delay
+        self.defer_rate = defer_rate
+        self.accepted = 0
+        self._lock = threading.Lock()
+
+    def record(self, rcpts):
+        with self._lock:
+            self.accepted += len(rcpts)
+            if self.log_path:
+                with open(self.log_path, 'a') as f:
+                    for rcpt in rcpts:
+                        f.write(rcpt + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor SMTP de prueba (acepta todo, no entrega)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--log', help='Archivo donde registrar un destinatario por línea')
+    parser.add_argument('--delay', type=float, default=0.0, help='Segundos de espera por mensaje')
+    parser.add_argument('--defer-rate', type=float, default=0.0,
+                        help='Fracción de mensajes respondidos con 451 (diferimiento)')
+    args = parser.parse_args()
+
+    server = StubSMTPServer((args.host, args.port), args.log, args.delay, args.defer_rate)
+    print(f"📧 Stub SMTP escuchando en {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{server.accepted} destinatarios aceptados")
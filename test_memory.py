@@ -0,0 +1,181 @@
+"""
+Prueba manual de memoria del envío: envía campañas de distintos tamaños contra el servidor
+SMTP de prueba y comprueba que el pico de RSS del proceso que envía no crece con el
+número de destinatarios.
+
+Uso:
+    python test_memory.py                          # 10.000 y 1.000.000 (tarda: cada envío confirma en SQLite)
+    python test_memory.py --sizes 10000,100000     # Prueba rápida
+
+Cada tamaño se envía en un proceso nuevo (el pico de RSS solo crece), con una base de
+datos temporal; no toca email_campaigns.db.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Configuración del envío (se lee al importar config en los procesos hijos)
+TEST_ENV = {
+    'SES_SMTP_HOST': '127.0.0.1',
+    'SES_SMTP_PORT': '2527',
+    'SES_SMTP_STARTTLS': 'false',
+    'SES_SMTP_USERNAME': 'test',
+    'SES_SMTP_PASSWORD': 'test',
+    'SENDER_EMAIL': 'pruebas@example.com',
+    'SES_MAX_SEND_RATE': '100000',
+    'DOMAIN_INITIAL_RATE': '100000',
+    'DOMAIN_MAX_RATE': '100000',
+}
+
+
+def rss_mb():
+    """RSS actual del proceso (Linux)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def send_child(db_path):
+    """Proceso hijo: envía la campaña de la base de datos y reporta la memoria usada"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from app import app, db, schedule_campaign
+    from models import Campaign
+    from scheduler import CampaignScheduler
+
+    # El envío lo hace el scheduler, como desde la API (con su propio lock, no el del servidor)
+    scheduler = CampaignScheduler(app, lock_path=os.path.join(os.path.dirname(db_path), 'scheduler.lock'))
+    with app.app_context():
+        campaign_id = db.session.query(Campaign.id).scalar()
+
+    baseline = rss_mb()
+    samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(1):
+            samples.append(round(rss_mb(), 1))
+
+    threading.Thread(target=sample, daemon=True).start()
+    started = time.time()
+    with app.app_context():
+        schedule_campaign(db.session.get(Campaign, campaign_id), {})
+    scheduler.start()
+    with app.app_context():
+        while db.session.query(Campaign.status).filter_by(id=campaign_id).scalar() in ('scheduled', 'sending'):
+            db.session.remove()
+            time.sleep(1)
+    done.set()
+
+    with app.app_context():
+        campaign = db.session.get(Campaign, campaign_id)
+        status, sent = campaign.status, campaign.total_sent
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        'status': status,
+        'sent': sent,
+        'seconds': round(time.time() - started, 1),
+        'baseline_mb': round(baseline, 1),
+        'peak_mb': round(peak, 1),
+        'samples': samples
+    }))
+
+
+def create_campaign(db_path, size):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from sender_node import create_app
+    from models import db, Campaign, Recipient
+    from mailer import prepare_campaign_html
+
+    app = create_app()
+    with app.app_context():
+        campaign = Campaign(
+            name=f'Prueba memoria {size}',
+            subject='Prueba memoria',
+            html_content='<html><body><p>Hola</p><a href="https://example.com">Enlace</a></body></html>'
+        )
+        db.session.add(campaign)
+        prepare_campaign_html(campaign)
+        db.session.flush()
+        for start in range(0, size, 20000):
+            db.session.execute(db.insert(Recipient), [
+                {'campaign_id': campaign.id, 'email': f'user{i}@dominio{i % 50}.test', 'domain': f'dominio{i % 50}.test'}
+                for i in range(start, min(size, start + 20000))
+            ])
+        db.session.commit()
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,1000000', help='Tamaños de campaña separados por comas')
+    parser.add_argument('--tolerance-mb', type=float, default=20, help='Crecimiento de RSS permitido entre tamaños')
+    parser.add_argument('--child', help=argparse.SUPPRESS)  # Base de datos a enviar (proceso hijo)
+    parser.add_argument('--populate', help=argparse.SUPPRESS)  # Base de datos a crear (proceso hijo)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.environ.update(TEST_ENV)
+
+    # La configuración se lee al importar: cada base de datos se crea y se envía en su proceso
+    if args.populate:
+        create_campaign(args.populate, args.size)
+        return
+    if args.child:
+        send_child(args.child)
+        return
+
+    from stub_smtp_server import StubSMTPServer
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        workdir = tempfile.mkdtemp(prefix='memory-test-')
+
+        server = StubSMTPServer(('127.0.0.1', 2527), os.devnull)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("\n📧 Stub SMTP en 127.0.0.1:2527")
+
+        results = {}
+        for size in sizes:
+            db_path = os.path.join(workdir, f'campaigns-{size}.db')
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--populate', db_path, '--size', str(size)],
+                           capture_output=True, check=True)
+            print(f"📧 Enviando {size} destinatarios...")
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', db_path],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = results[size] = json.loads(output.strip().splitlines()[-1])
+            result['growth_mb'] = round(result['peak_mb'] - result['baseline_mb'], 1)
+            print(f"   {result['sent']} enviados en {result['seconds']} s, estado {result['status']}: "
+                  f"RSS inicial {result['baseline_mb']} MB, pico {result['peak_mb']} MB (+{result['growth_mb']} MB)")
+
+        smallest, largest = results[sizes[0]], results[sizes[-1]]
+        incomplete = [size for size, result in results.items() if result['sent'] != size]
+
+        if incomplete:
+            print(f"\n❌ ERROR: envíos incompletos para {incomplete}")
+            sys.exit(1)
+        elif largest['growth_mb'] - smallest['growth_mb'] > args.tolerance_mb:
+            print(f"\n❌ ERROR: la memoria crece con el tamaño de la campaña "
+                  f"(+{smallest['growth_mb']} MB con {sizes[0]}, +{largest['growth_mb']} MB con {sizes[-1]})")
+            sys.exit(1)
+        else:
+            print(f"\n✅ MEMORIA CONSTANTE: +{smallest['growth_mb']} MB con {sizes[0]} destinatarios, "
+                  f"+{largest['growth_mb']} MB con {sizes[-1]}")
+
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Prueba manual del envío por shards: varios procesos sender_node.py contra el servidor
+SMTP de prueba, comprobando que cada destinatario se envía exactamente una vez.
+
+Uso:
+    python test_sharding.py                        # 2000 destinatarios, 8 shards, 4 nodos
+    python test_sharding.py --kill                 # Mata un nodo a mitad del envío
+    python test_sharding.py --resume               # Detiene el envío y lo reanuda sin shards
+    python test_sharding.py --recipients 5000 --nodes 6
+
+Usa una base de datos temporal; no toca email_campaigns.db.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--kill', action='store_true', help='Matar un nodo (SIGKILL) a mitad del envío')
+    parser.add_argument('--resume', action='store_true', help='Detener el envío y reanudarlo sin shards')
+    parser.add_argument('--timeout', type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='sharding-test-')
+    db_path = os.path.join(workdir, 'campaigns.db')
+    log_path = os.path.join(workdir, 'rcpts.log')
+
+    # Configuración de los nodos (y de este proceso) antes de importar config
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'SES_SMTP_HOST': '127.0.0.1',
+        'SES_SMTP_PORT': '2525',
+        'SES_SMTP_STARTTLS': 'false',
+        'SES_SMTP_USERNAME': 'test',
+        'SES_SMTP_PASSWORD': 'test',
+        'SENDER_EMAIL': 'pruebas@example.com',
+        'SHARD_LEASE_SECONDS': '5',
+        'SES_MAX_SEND_RATE': '500',
+        'SENDER_NODE_SEND_RATE': '500',
+        'DOMAIN_INITIAL_RATE': '50',
+    })
+
+    from stub_smtp_server import StubSMTPServer
+    from sender_node import create_app
+    from models import db, Campaign, Recipient, SendShard
+    from mailer import prepare_campaign_html
+    from sharding import create_shards
+
+    try:
+        server = StubSMTPServer(('127.0.0.1', 2525), log_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"\n📧 Stub SMTP en 127.0.0.1:2525, registro en {log_path}")
+
+        app = create_app()
+        with app.app_context():
+            campaign = Campaign(
+                name='Prueba shards',
+                subject='Prueba shards',
+                html_content='<html><body><p>Hola</p><a href="https://example.com">Enlace</a></body></html>'
+            )
+            db.session.add(campaign)
+            prepare_campaign_html(campaign)
+            db.session.flush()
+            db.session.execute(db.insert(Recipient), [
+                {'campaign_id': campaign.id, 'email': f'user{i}@dominio{i % 20}.test', 'domain': f'dominio{i % 20}.test'}
+                for i in range(args.recipients)
+            ])
+            create_shards(campaign, args.shards)
+            campaign.status = 'sending'
+            db.session.commit()
+            campaign_id = campaign.id
+
+        print(f"📧 Campaña {campaign_id}: {args.recipients} destinatarios en {args.shards} shards")
+        print(f"📧 Lanzando {args.nodes} nodos\n")
+
+        node_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sender_node.py')
+        nodes = [
+            subprocess.Popen([sys.executable, node_script, '--exit-when-idle', '--node-id', f'nodo-{i}'])
+            for i in range(args.nodes)
+        ]
+
+        killed = 0
+        if args.kill:
+            time.sleep(2)
+            nodes[0].kill()
+            killed = 1
+            print("\n💥 nodo-0 eliminado; sus shards se reasignan al caducar el lease\n")
+
+        if args.resume:
+            # Detener a mitad del envío y reanudar sin sharded: los shards abiertos se cierran
+            # y ningún nodo debe volver a tomarlos mientras envía este proceso
+            from app import app as web
+            from config import Config
+            client = web.test_client()
+            client.post('/login', data={'email': Config.ADMIN_EMAIL, 'password': Config.ADMIN_PASSWORD})
+            time.sleep(2)
+            client.post(f'/api/campaigns/{campaign_id}/stop')
+            print("\n⏸  Envío detenido; reanudando sin shards\n")
+            deadline = time.time() + args.timeout
+            while client.post(f'/api/campaigns/{campaign_id}/send', json={}).status_code != 200:
+                if time.time() > deadline:
+                    raise RuntimeError('no se pudo reanudar la campaña')
+                time.sleep(0.5)  # Un nodo aún tiene un lease vigente
+            with app.app_context():
+                while db.session.get(Campaign, campaign_id).status in ('scheduled', 'sending'):
+                    if time.time() > deadline:
+                        raise RuntimeError('la campaña no terminó a tiempo')
+                    db.session.remove()
+                    time.sleep(1)
+
+        started = time.time()
+        for node in nodes:
+            node.wait(timeout=max(1, args.timeout - (time.time() - started)))
+
+        with app.app_context():
+            emails = [email for (email,) in db.session.query(Recipient.email).filter_by(campaign_id=campaign_id)]
+            unsent = Recipient.query.filter_by(campaign_id=campaign_id, sent=False).count()
+            status = db.session.get(Campaign, campaign_id).status
+            shards = SendShard.query.filter_by(campaign_id=campaign_id).all()
+
+        with open(log_path) as f:
+            delivered = Counter(line.strip() for line in f if line.strip())
+
+        missing = [email for email in emails if delivered[email] == 0]
+        duplicated = {email: count for email, count in delivered.items() if count > 1}
+
+        print(f"\nEstado de la campaña: {status}")
+        print(f"Destinatarios: {len(emails)}, entregados al stub: {sum(delivered.values())}, sin marcar como enviados: {unsent}")
+        for shard in shards:
+            print(f"  shard {shard.shard_index}: {shard.status}, {shard.sent_count} enviados, último nodo {shard.lease_owner or '-'}")
+
+        if missing or unsent or status != 'sent':
+            print(f"\n❌ ERROR: {len(missing)} destinatarios sin entregar")
+            sys.exit(1)
+        elif duplicated and len(duplicated) > killed:
+            print(f"\n❌ ERROR: {len(duplicated)} destinatarios entregados más de una vez: {list(duplicated)[:10]}")
+            sys.exit(1)
+        elif duplicated:
+            # Un nodo eliminado entre la respuesta del SMTP y el commit deja ese envío sin registrar
+            print(f"\n⚠️  Exactamente una vez salvo {len(duplicated)} envío en vuelo del nodo eliminado: {list(duplicated)}")
+        else:
+            print("\n✅ CADA DESTINATARIO SE ENVIÓ EXACTAMENTE UNA VEZ")
+
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
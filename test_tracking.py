@@ -0,0 +1,80 @@
+"""
+Prueba manual de las redirecciones de clics: genera los enlaces de tracking de una campaña
+(formato antiguo ?url= y enlaces cortos) y comprueba que cada uno redirige a su destino.
+
+Uso:
+    python test_tracking.py
+
+Usa una base de datos temporal; no toca email_campaigns.db.
+"""
+
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+
+# Cada enlace con el destino al que debe redirigir
+LINKS = [
+    ('https://example.com/simple', 'https://example.com/simple'),
+    ('https://example.com/p?a=1&amp;b=2', 'https://example.com/p?a=1&b=2'),
+    ('https://example.com/p?utm=Black%20Friday', 'https://example.com/p?utm=Black%20Friday'),
+    ('https://example.com/p?q=caf%C3%A9&amp;ref=mail', 'https://example.com/p?q=caf%C3%A9&ref=mail'),
+]
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='tracking-test-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'campaigns.db')}"
+
+    from app import app
+    from models import db, Campaign, Recipient
+    from mailer import add_tracking, prepare_campaign_html, render_html, HREF_PATTERN
+
+    failures = 0
+    try:
+        with app.app_context():
+            campaign = Campaign(
+                name='Prueba tracking',
+                subject='Prueba tracking',
+                html_content='<html><body>' + ''.join(
+                    f'<a href="{href}">Enlace {i}</a>' for i, (href, _) in enumerate(LINKS)
+                ) + '</body></html>'
+            )
+            db.session.add(campaign)
+            prepare_campaign_html(campaign)
+            db.session.flush()
+            recipient = Recipient(campaign_id=campaign.id, email='user@example.com', domain='example.com')
+            db.session.add(recipient)
+            db.session.commit()
+
+            # Emails ya enviados con el formato antiguo y emails con enlaces cortos
+            legacy = [href for _, href in HREF_PATTERN.findall(add_tracking(campaign.html_content, recipient.tracking_token))]
+            short = [href for _, href in HREF_PATTERN.findall(render_html(campaign, recipient.tracking_token))]
+
+        client = app.test_client()
+        for kind, hrefs in (('?url=', legacy), ('corto', short)):
+            for href, (original, expected) in zip(hrefs, LINKS):
+                location = client.get(urlsplit(href)._replace(scheme='', netloc='').geturl()).headers['Location']
+                ok = location == expected
+                failures += not ok
+                print(f"{'✅' if ok else '❌'} [{kind}] {original} -> {location}")
+
+        # Un destino que no está en la campaña no se redirige
+        location = client.get(f'/track/click/{recipient.tracking_token}?url=https%3A%2F%2Fevil.test').headers['Location']
+        ok = location == '/'
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} [?url=] https://evil.test -> {location}")
+
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        sys.exit(1)
+
+    if failures:
+        print(f"\n❌ ERROR: {failures} redirecciones incorrectas")
+        sys.exit(1)
+    print("\n✅ TODAS LAS REDIRECCIONES LLEGAN A SU DESTINO")
+
+
+if __name__ == '__main__':
+    main()